@@ -1,181 +1,1152 @@
 import pygame
 import numpy as np
-import sys
 import math
+import multiprocessing
+import tracemalloc
+from multiprocessing import shared_memory
+
+import input_trace
 
 # --- 設定パラメータ ---
 WINDOW_W, WINDOW_H = 800, 600
 HAIR_COUNT = 10000  # 毛の本数
 GRID_SIZE = 40  # 物理計算の粗さ
+FINE_DIV = 4  # なでたセルだけ FINE_DIV x FINE_DIV に細かく分けて角度を持つ
 HAIR_LENGTH = 15  # 毛の長さ
 
 # 【新設】ブラシの設定
 BRUSH_RADIUS = 80  # 手の大きさ（半径ピクセル）。ここを変えると手の大きさが変わります。
 BRUSH_STRENGTH = 0.4  # なでる強さ（0.0 ~ 1.0）。大きいとくっきり跡がつきます。
 
+# 描画方式
+# "numpy"（画素配列に直接書く） / "pygame"（draw.line を1本ずつ）
+HAIR_RASTERIZER = "numpy"
+ANGLE_BINS = 256  # numpy 描画で毛の角度を何段階に丸めるか
+USE_SCRATCH_BUFFERS = True  # numpy 描画の途中の配列を毎フレーム作らずに使い回す
+RENDER_WORKERS = 0  # 1以上ならタイルに分けてその数の子プロセスで描く（0 は今まで通り）
+RENDER_TILE_CELLS = 4  # 並列描画の1タイルの大きさ（セル数）
+MAX_DIRTY_BOXES = 8  # 描き直す矩形がこれより多ければ1つにまとめる
+
+# 毛並みのなじみ（周りのセルの向きに少しずつ揃っていく）。D キーでも切り替えられる
+USE_RELAXATION = False
+RELAX_RATE = 0.1  # 1フレームに周りとの角度差のどれだけ寄せるか（0 ~ 1）
+RELAX_EPSILON = 1e-3  # これより小さい変化は無視する（落ち着いたら描き直さない）
+
 # 色の設定 (RGB)
+BG_COLOR = (15, 30, 45)  # 毛の隙間から見える地の色
 COLOR_DARK = np.array([20, 40, 60], dtype=np.float32)  # 寝ている時
 COLOR_LIGHT = np.array([200, 220, 240], dtype=np.float32)  # 逆立っている時
+COLOR_RANGE = COLOR_LIGHT - COLOR_DARK
+
+
+def _wrap_angle(diff):
+    """角度差を -PI ~ PI に正規化"""
+    return (diff + np.pi) % (2 * np.pi) - np.pi
+
+
+def _relax_delta(padded, rate):
+    """周りを1マスずつ足した (..., W+2, H+2) の角度から、上下左右へ寄せる量を求める"""
+    center = padded[..., 1:-1, 1:-1]
+    total = _wrap_angle(padded[..., :-2, 1:-1] - center)
+    total += _wrap_angle(padded[..., 2:, 1:-1] - center)
+    total += _wrap_angle(padded[..., 1:-1, :-2] - center)
+    total += _wrap_angle(padded[..., 1:-1, 2:] - center)
+    return total * (rate / 4)
+
+
+class ScratchBuffers:
+    """名前ごとに使い回す作業用の配列
+
+    get() は同じ名前なら前回と同じメモリの先頭を必要な形で返すので、
+    大きさが足りている間は新しい配列を作らない（最初のフレームで最大の大きさになる）。
+    enabled=False なら毎回 np.empty を返す（今まで通り毎フレーム確保する）。
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.buffers = {}
+
+    def get(self, name, shape, dtype):
+        if not self.enabled:
+            return np.empty(shape, dtype)
+        size = math.prod(shape)
+        buf = self.buffers.get(name)
+        if buf is None or buf.size < size or buf.dtype != dtype:
+            buf = self.buffers[name] = np.empty(max(size, 1), dtype)
+        return buf[:size].reshape(shape)
+
+
+class HairRasterizer:
+    """短い直線（毛）をまとめて画素配列に書き込む
+
+    角度を ANGLE_BINS 段階、長さを1px単位に丸め、
+    (角度, 長さ) ごとに「始点から何画素先を塗るか」のスタンプを先に作っておく。
+    毛1本ぶんの画素は 始点 + スタンプ なので、
+    全部の毛を1回の gather と1回の代入で描ける（Python のループ無し）。
+    """
+
+    def __init__(self, width, height, max_length, angle_bins=ANGLE_BINS):
+        self.width = width
+        self.height = height
+        self.max_length = max_length = int(math.ceil(max_length))
+        self.angle_bins = angle_bins
+
+        # DDA：長さ L の線を L+1 点でなぞる（短い線は同じ画素を何度か塗るだけ）
+        steps = max_length + 1
+        angle = np.arange(angle_bins) * (2 * np.pi / angle_bins)
+        length = np.arange(max_length + 1)
+        t = np.linspace(0.0, 1.0, steps)
+        reach = length[None, :, None] * t[None, None, :]
+        self.dx = np.rint(np.cos(angle)[:, None, None] * reach).astype(np.int32)
+        self.dy = np.rint(np.sin(angle)[:, None, None] * reach).astype(np.int32)
+        self.dx = self.dx.reshape(-1, steps)
+        self.dy = self.dy.reshape(-1, steps)
+        self.offsets = self.dy * width + self.dx  # 画素配列を1次元で見た時のずれ
+        self.arange = np.arange(0)  # 0, 1, 2, ...（足りなくなったら作り直す）
+
+    def supports(self, surface):
+        """この surface に直接書き込めるか（32bit・同じ大きさ・行に隙間が無い）"""
+        return (
+            surface.get_size() == (self.width, self.height)
+            and surface.get_bytesize() == 4
+            and surface.get_pitch() == self.width * 4
+        )
+
+    def stamp_index(self, angles, lengths, scratch):
+        """毛ごとのスタンプ番号"""
+        n = len(angles)
+        f = scratch.get("stamp_f", (n,), np.float32)
+        bins = scratch.get("stamp_bins", (n,), np.intp)
+        index = scratch.get("stamp_len", (n,), np.int32)
+
+        np.multiply(angles, self.angle_bins / (2 * np.pi), out=f)
+        f += 0.5
+        np.floor(f, out=f)
+        np.copyto(bins, f, casting="unsafe")
+        np.remainder(bins, self.angle_bins, out=bins)
+
+        np.add(lengths, 0.5, out=f)
+        np.clip(f, 0, self.max_length, out=f)
+        np.copyto(index, f, casting="unsafe")
+
+        np.multiply(bins, self.max_length + 1, out=bins)
+        bins += index
+        return bins
+
+    def map_colors(self, surface, colors, scratch):
+        """(N, 3) の uint8 の色を surface の画素値に変換する"""
+        n = len(colors)
+        c = scratch.get("color_u32", (n, 3), np.uint32)
+        mapped = scratch.get("color_mapped", (n,), np.uint32)
+        channel = scratch.get("color_channel", (n,), np.uint32)
+        np.copyto(c, colors)
+
+        shifts = surface.get_shifts()
+        losses = surface.get_losses()
+        mapped[:] = surface.get_masks()[3]  # アルファは不透明
+        for i in range(3):
+            np.right_shift(c[:, i], losses[i], out=channel)
+            np.left_shift(channel, shifts[i], out=channel)
+            mapped |= channel
+        return mapped
+
+    def _nonzero(self, mask, count, scratch, name):
+        """np.flatnonzero(mask) を scratch の配列に書く（count は True の数）
+
+        True の位置に「何番目の True か」を累積和で付け、False はすべて
+        末尾の捨て場所に向けて put する。
+        """
+        n = len(mask)
+        pos = scratch.get(name + "_pos", (n,), np.intp)
+        out = scratch.get(name, (count + 1,), np.intp)
+        inverse = scratch.get(name + "_not", (n,), bool)
+        np.copyto(pos, mask)
+        np.cumsum(pos, out=pos)
+        pos -= 1
+        np.logical_not(mask, out=inverse)
+        np.copyto(pos, count, where=inverse)
+        np.put(out, pos, self.arange[:n], mode="clip")
+        return out[:count]
+
+    def draw(
+        self,
+        surface,
+        starts,
+        angles,
+        lengths,
+        colors,
+        clip=None,
+        scratch=None,
+        origin=(0, 0),
+    ):
+        """starts から角度 angles・長さ lengths の毛を colors で描く
+
+        clip（Rect）を渡すとその外には書かない。
+        origin は surface の左上が全体の座標でどこにあたるか（下書きに描く時に使う）。
+        毛は番号順に1回の代入で書くので、重なった所は番号の大きい毛が上になる
+        （draw.line を順に呼んだのと同じ）。
+        scratch（ScratchBuffers）を渡すと途中の配列をすべてそこから借りる。
+        """
+        if scratch is None:
+            scratch = ScratchBuffers(enabled=False)
+        w = self.width
+        if clip is None:
+            left, top, right, bottom = 0, 0, self.width, self.height
+        else:
+            clip = clip.clip(surface.get_rect())
+            left, top, right, bottom = clip.left, clip.top, clip.right, clip.bottom
+
+        n = len(angles)
+        steps = self.max_length + 1
+        if len(self.arange) < n:
+            self.arange = np.arange(n)
+        arange = self.arange
+
+        stamp = self.stamp_index(angles, lengths, scratch)
+        mapped = self.map_colors(surface, colors, scratch)
+        x0 = scratch.get("x0", (n,), np.int32)
+        y0 = scratch.get("y0", (n,), np.int32)
+        np.copyto(x0, starts[:, 0], casting="unsafe")
+        np.copyto(y0, starts[:, 1], casting="unsafe")
+        if origin != (0, 0):
+            x0 -= origin[0]
+            y0 -= origin[1]
+
+        base = scratch.get("base", (n,), np.int32)
+        np.multiply(y0, w, out=base)
+        base += x0
+        idx = scratch.get("idx", (n, steps), np.int32)
+        np.take(self.offsets, stamp, axis=0, out=idx, mode="clip")
+        idx += base[:, None]
+
+        # clip の端に近い毛だけは外にはみ出すので、1画素ずつ範囲を確かめる。
+        # はみ出した画素は同じ毛の中の内側の画素に向け直す（同じ色を2回塗るだけ）
+        m = self.max_length
+        near = scratch.get("near", (n,), bool)
+        tmp = scratch.get("near_tmp", (n,), bool)
+        np.less(x0, left + m, out=near)
+        np.greater_equal(x0, right - m, out=tmp)
+        near |= tmp
+        np.less(y0, top + m, out=tmp)
+        near |= tmp
+        np.greater_equal(y0, bottom - m, out=tmp)
+        near |= tmp
+
+        ne = int(np.count_nonzero(near))
+        if ne:
+            edge = self._nonzero(near, ne, scratch, "edge")
+            edge_stamp = scratch.get("edge_stamp", (ne,), np.intp)
+            edge_x0 = scratch.get("edge_x0", (ne,), np.int32)
+            edge_y0 = scratch.get("edge_y0", (ne,), np.int32)
+            np.take(stamp, edge, out=edge_stamp, mode="clip")
+            np.take(x0, edge, out=edge_x0, mode="clip")
+            np.take(y0, edge, out=edge_y0, mode="clip")
+
+            xs = scratch.get("edge_xs", (ne, steps), np.int32)
+            ys = scratch.get("edge_ys", (ne, steps), np.int32)
+            np.take(self.dx, edge_stamp, axis=0, out=xs, mode="clip")
+            np.take(self.dy, edge_stamp, axis=0, out=ys, mode="clip")
+            xs += edge_x0[:, None]
+            ys += edge_y0[:, None]
+
+            ok = scratch.get("edge_ok", (ne, steps), bool)
+            out = scratch.get("edge_out", (ne, steps), bool)
+            np.greater_equal(xs, left, out=ok)
+            np.less(xs, right, out=out)
+            ok &= out
+            np.greater_equal(ys, top, out=out)
+            ok &= out
+            np.less(ys, bottom, out=out)
+            ok &= out
+
+            # 毛ごとに最初の内側の画素（flat は edge_ys を1次元で見た時の位置）
+            col = scratch.get("edge_col", (ne,), np.intp)
+            flat = scratch.get("edge_flat", (ne,), np.intp)
+            np.argmax(ok, axis=1, out=col)
+            np.multiply(arange[:ne], steps, out=flat)
+            flat += col
+
+            inside = ys  # 以降 ys は画素配列を1次元で見た時の位置
+            np.multiply(ys, w, out=inside)
+            inside += xs
+            fallback = scratch.get("edge_fallback", (ne,), np.int32)
+            has = scratch.get("edge_has", (ne,), bool)
+            np.take(inside.reshape(-1), flat, out=fallback, mode="clip")
+            np.take(ok.reshape(-1), flat, out=has, mode="clip")
+
+            np.logical_not(ok, out=out)
+            np.copyto(inside, fallback[:, None], where=out)
+            idx[edge] = inside
+
+            # 1画素も入らない毛は描かない
+            kept = n - (ne - int(np.count_nonzero(has)))
+            if kept < n:
+                keep = scratch.get("keep", (n,), bool)
+                keep[:] = True
+                keep[edge] = has
+                rows = self._nonzero(keep, kept, scratch, "kept")
+                idx_kept = scratch.get("idx_kept", (kept, steps), np.int32)
+                mapped_kept = scratch.get("mapped_kept", (kept,), np.uint32)
+                np.take(idx, rows, axis=0, out=idx_kept, mode="clip")
+                np.take(mapped, rows, out=mapped_kept, mode="clip")
+                idx, mapped = idx_kept, mapped_kept
+
+        pixels = pygame.surfarray.pixels2d(surface)
+        flat = pixels.T.reshape(-1)  # (h, w) の連続した配列として見る
+        flat[idx] = mapped[:, None]
+        del flat, pixels  # ロック解除
+
+
+def draw_hair_arrays(
+    surface,
+    arrays,
+    angle_table,
+    rasterizer,
+    scratch,
+    hairs=slice(None),
+    clip=None,
+    origin=(0, 0),
+):
+    """毛ごとの配列 arrays（VelvetSimulator.hair_arrays と同じ形）から毛を描く
+
+    角度は angle_table[arrays["field"]] に毛ごとのばらつきを足したもの。
+    途中の配列はすべて scratch から借りて out= で書き込むので、
+    USE_SCRATCH_BUFFERS なら2フレーム目からは配列を新しく確保しない。
+    VelvetSimulator の外（ParallelHairRenderer の子プロセス）からも使う。
+    """
+    get = scratch.get
+    if isinstance(hairs, slice):
+        part = {name: src[hairs] for name, src in arrays.items()}
+    else:
+        part = {}
+        for name, src in arrays.items():
+            part[name] = get(name, (len(hairs),) + src.shape[1:], src.dtype)
+            np.take(src, hairs, axis=0, out=part[name], mode="clip")
+    n = len(part["field"])
+
+    # 1. 角度（field は int32 で持っているので、take の中で変換用の配列が
+    # 作られないように intp の作業用配列に写してから引く）
+    field = get("field_index", (n,), np.intp)
+    np.copyto(field, part["field"])
+    angles = get("angles", (n,), np.float32)
+    np.take(angle_table, field, out=angles, mode="clip")
+    angles += part["jitter"]
+
+    # 2. 色 = COLOR_DARK + (COLOR_LIGHT - COLOR_DARK) * factor + ばらつき
+    factor = get("factor", (n,), np.float32)
+    np.cos(angles, out=factor)
+    np.negative(factor, out=factor)
+    factor += 1.0
+    factor /= 2.0
+    np.clip(factor, 0.0, 1.0, out=factor)
+
+    colors = get("colors", (n, 3), np.float32)
+    np.multiply(factor[:, np.newaxis], COLOR_RANGE, out=colors)
+    colors += COLOR_DARK
+    colors += part["color_vars"][:, np.newaxis]
+    np.clip(colors, 0, 255, out=colors)
+    colors_int = get("colors_int", (n, 3), np.uint8)
+    np.copyto(colors_int, colors, casting="unsafe")
+
+    # 3. 描画
+    rasterizer.draw(
+        surface,
+        part["pos"],
+        angles,
+        part["lengths"],
+        colors_int,
+        clip,
+        scratch,
+        origin,
+    )
+
+
+class VelvetSimulator:
+    """ベルベット1枚分の状態（角度グリッド・毛・描き溜めたレイヤー）
+
+    角度は2段階で持つ：
+      grid_angles  ... 画面全体の粗いグリッド（GRID_SIZE 四方で1つ）
+      fine         ... ブラシが触れたセル（タイル）だけの細かいグリッド
+    どちらも angle_table という1本の配列の中にあり、毛ごとに「どこを読むか」
+    （hair_field）を持っているので、毛の角度は1回の gather で読める。
+
+    配列はすべて作った時に確保し、毎フレームは
+      step(mouse_pos, mouse_pressed)  ... なでた所の角度を更新
+      render_into(surface)            ... 変わった所だけ描き直して blit
+    を呼ぶだけ（relax なら step で毛並みを少しずつならす）。pygame の初期化やウィンドウには触らないので、
+    1つのプロセスで何枚でも作れる（ベンチマークや埋め込み用）。
+    """
+
+    def __init__(
+        self,
+        width=WINDOW_W,
+        height=WINDOW_H,
+        hair_count=HAIR_COUNT,
+        grid_size=GRID_SIZE,
+        seed=None,
+        mode=HAIR_RASTERIZER,
+        scratch=USE_SCRATCH_BUFFERS,
+        relax=USE_RELAXATION,
+    ):
+        self.width = width
+        self.height = height
+        self.hair_count = hair_count
+        self.grid_size = grid_size
+        self.mode = mode
+        self.relax = relax
+
+        # seed が無ければ np.random 全体の乱数を使う（np.random.seed で再現できる）
+        rng = np.random if seed is None else np.random.RandomState(seed)
+
+        # --- データ準備 ---
+        self.cols = cols = math.ceil(width / grid_size)
+        self.rows = rows = math.ceil(height / grid_size)
+
+        # グリッドの角度（初期化）
+        # angle_table の先頭 cols * rows 個が粗いグリッド、その後ろが細かいタイル
+        self.fine_div = FINE_DIV
+        self.fine_size = grid_size / FINE_DIV
+        self.angle_table = (rng.rand(cols, rows) * 0.5 - 0.25).astype(np.float32)
+        self.angle_table = self.angle_table.ravel()
+        self._bind_angle_views()
+
+        # 細かいタイル：tile_slot[gx, gy] は fine の何番目か（無ければ -1）、
+        # fine_tiles[slot] はそのタイルのセル (gx, gy)
+        self.tile_slot = np.full((cols, rows), -1, dtype=np.int32)
+        self.fine_tiles = np.zeros((0, 2), dtype=np.int32)
+        self.fine_count = 0
+
+        # 毛のデータ
+        self.hair_pos = rng.rand(hair_count, 2).astype(np.float32)
+        self.hair_pos[:, 0] *= width
+        self.hair_pos[:, 1] *= height
+
+        self.hair_props = rng.rand(hair_count, 2).astype(np.float32)
+        self.hair_lengths = (self.hair_props[:, 0] * 0.4 + 0.8) * HAIR_LENGTH
+        self.hair_color_vars = (self.hair_props[:, 1] - 0.5) * 40.0
+
+        # 毛ごとの定数（毛は動かないので最初に1回だけ計算する）
+        # cell は grid_angles を1次元で見た時のセル番号 (gx * rows + gy)
+        gx = np.clip((self.hair_pos[:, 0] / grid_size).astype(np.int32), 0, cols - 1)
+        gy = np.clip((self.hair_pos[:, 1] / grid_size).astype(np.int32), 0, rows - 1)
+        cell = gx * rows + gy
+        self.hair_jitter = (self.hair_props[:, 1] - 0.5) * 0.2  # 角度のばらつき
+
+        # 細かいタイルの中での位置 (sx * FINE_DIV + sy)
+        fine_size = self.fine_size
+        sx = (self.hair_pos[:, 0] / fine_size).astype(np.int32) - gx * FINE_DIV
+        sy = (self.hair_pos[:, 1] / fine_size).astype(np.int32) - gy * FINE_DIV
+        sx = np.clip(sx, 0, FINE_DIV - 1)
+        sy = np.clip(sy, 0, FINE_DIV - 1)
+        self.hair_sub = (sx * FINE_DIV + sy).astype(np.int32)
+        # 毛の角度を angle_table のどこから読むか（最初は全部粗いグリッド）
+        self.hair_field = cell.astype(np.int32)
+
+        # 描画に使う毛ごとの配列（draw_hair_arrays に渡す。中身は書き換えるが差し替えない）
+        self.hair_arrays = {
+            "pos": self.hair_pos,
+            "lengths": self.hair_lengths,
+            "field": self.hair_field,
+            "jitter": self.hair_jitter,
+            "color_vars": self.hair_color_vars,
+        }
+
+        # セルごとの毛の一覧（CSR形式）：
+        # cell_hairs[cell_start[c] : cell_start[c + 1]] がセル c に根元がある毛の番号
+        self.cell_hairs = np.argsort(cell, kind="stable").astype(np.int32)
+        self.cell_start = np.searchsorted(
+            cell[self.cell_hairs], np.arange(cols * rows + 1)
+        ).astype(np.int32)
+
+        # 計算用バッファ
+        self.end_pos = np.zeros((hair_count, 2), dtype=np.float32)
+        self.rasterizer = HairRasterizer(width, height, HAIR_LENGTH * 1.2)
+        self.scratch = ScratchBuffers(enabled=scratch)
+
+        # 描き溜めたベルベット（角度が変わったセルの周りだけ描き直す）
+        # レイヤーは描き込む先の画素形式に合わせたいので、最初の render_into で作る
+        self.layer = None
+        self.dirty_cells = np.ones((cols, rows), dtype=bool)  # 最初は全部描く
+        self.last_mouse_pos = None
+
+    def invalidate(self):
+        """次の render_into で全体を描き直す"""
+        self.dirty_cells[:] = True
+
+    def mark_dirty(self, x0, x1, y0, y1, changed):
+        """セル [x0, x1) x [y0, y1) のうち changed の所を描き直す印を付ける"""
+        self.dirty_cells[x0:x1, y0:y1] |= changed
+
+    def dirty_halo(self):
+        """dirty_cells とその上下左右斜めのセル（変わった毛がはみ出しうる範囲）"""
+        dirty = self.dirty_cells
+        halo = dirty.copy()
+        halo[1:] |= dirty[:-1]
+        halo[:-1] |= dirty[1:]
+        wide = halo.copy()
+        halo[:, 1:] |= wide[:, :-1]
+        halo[:, :-1] |= wide[:, 1:]
+        return halo
+
+    def dirty_boxes(self):
+        """描き直すセルの矩形 [x0, x1) x [y0, y1) のリスト
+
+        dirty_halo を、全部きれいな列・行で区切れる所で分けて囲んでいく。
+        離れた2か所が変わっても、間のセルは描き直さない。
+        矩形が MAX_DIRTY_BOXES より多くなったら全部を1つで囲む。
+        """
+        halo = self.dirty_halo()
+        boxes = []
+        stack = [(0, self.cols, 0, self.rows)]
+        while stack:
+            x0, x1, y0, y1 = stack.pop()
+            area = halo[x0:x1, y0:y1]
+            xs = np.flatnonzero(area.any(axis=1)) + x0
+            if not len(xs):
+                continue
+            ys = np.flatnonzero(area.any(axis=0)) + y0
+
+            # きれいな列があればそこで分け、無ければきれいな行で分ける
+            cut = np.flatnonzero(np.diff(xs) > 1)
+            if len(cut):
+                starts, ends = xs[np.r_[0, cut + 1]], xs[np.r_[cut, -1]] + 1
+                for a, b in zip(starts.tolist(), ends.tolist()):
+                    stack.append((a, b, int(ys[0]), int(ys[-1]) + 1))
+                continue
+            cut = np.flatnonzero(np.diff(ys) > 1)
+            if len(cut):
+                starts, ends = ys[np.r_[0, cut + 1]], ys[np.r_[cut, -1]] + 1
+                for a, b in zip(starts.tolist(), ends.tolist()):
+                    stack.append((int(xs[0]), int(xs[-1]) + 1, a, b))
+                continue
+            boxes.append((int(xs[0]), int(xs[-1]) + 1, int(ys[0]), int(ys[-1]) + 1))
+
+        if len(boxes) > MAX_DIRTY_BOXES:
+            x0s, x1s, y0s, y1s = zip(*boxes)
+            boxes = [(min(x0s), max(x1s), min(y0s), max(y1s))]
+        return boxes
+
+    def _bind_angle_views(self):
+        """angle_table を作り直した後に grid_angles と fine を付け直す"""
+        base = self.cols * self.rows
+        f = self.fine_div
+        self.grid_angles = self.angle_table[:base].reshape(self.cols, self.rows)
+        self.fine = self.angle_table[base:].reshape(-1, f, f)
+
+    def alloc_fine_tiles(self, tx, ty):
+        """セル (tx, ty) に細かいタイルが無ければ作る
+
+        新しいタイルは粗いグリッドの値で埋めるので、作っただけでは見た目は変わらない。
+        そのセルに根元がある毛は、以降は細かいタイルの方を読む。
+        """
+        new = self.tile_slot[tx, ty] < 0
+        tx, ty = tx[new], ty[new]
+        count = len(tx)
+        if not count:
+            return
+
+        need = self.fine_count + count
+        capacity = len(self.fine)
+        if need > capacity:
+            # 足りなくなったら倍に広げる（角度の並びは変わらないので hair_field はそのまま）
+            # タイルはセルの数より多くはならない
+            base = self.cols * self.rows
+            capacity = min(max(need, capacity * 2, 16), base)
+            table = np.empty(base + capacity * self.fine_div**2, dtype=np.float32)
+            table[: len(self.angle_table)] = self.angle_table
+            self.angle_table = table
+            self._bind_angle_views()
+            tiles = np.zeros((capacity, 2), dtype=np.int32)
+            tiles[: self.fine_count] = self.fine_tiles[: self.fine_count]
+            self.fine_tiles = tiles
+
+        slots = np.arange(self.fine_count, need)
+        self.tile_slot[tx, ty] = slots
+        self.fine_tiles[slots, 0] = tx
+        self.fine_tiles[slots, 1] = ty
+        self.fine[slots] = self.grid_angles[tx, ty][:, np.newaxis, np.newaxis]
+        self.fine_count = need
+
+        base = self.cols * self.rows
+        cells = tx * self.rows + ty
+        for cell, slot in zip(cells.tolist(), slots.tolist()):
+            hairs = self.cell_hairs[self.cell_start[cell] : self.cell_start[cell + 1]]
+            self.hair_field[hairs] = (
+                base + slot * self.fine_div**2 + self.hair_sub[hairs]
+            )
+
+    def sync_coarse(self, slots):
+        """細かいタイルの平均の向きを、そのセルの粗いグリッドに書き戻す
+
+        粗いグリッドは細かいタイルの無いセルの描画と、なじませる時の隣の値に使う。
+        """
+        tiles = self.fine[slots]
+        mean_sin = np.sin(tiles).mean(axis=(1, 2))
+        mean_cos = np.cos(tiles).mean(axis=(1, 2))
+        tx, ty = self.fine_tiles[slots, 0], self.fine_tiles[slots, 1]
+        self.grid_angles[tx, ty] = np.arctan2(mean_sin, mean_cos)
+
+    def step(self, mouse_pos, mouse_pressed):
+        """1フレーム分の入力を受け取る（押している間だけなでる）"""
+        if mouse_pressed and self.last_mouse_pos is not None:
+            self.brush(mouse_pos, self.last_mouse_pos)
+        self.last_mouse_pos = mouse_pos
+        if self.relax:
+            self.relax_field()
+
+    def relax_field(self, rate=RELAX_RATE):
+        """毛並みを上下左右のセルの向きに少しずつ寄せる（角度の拡散を1ステップ）
+
+        細かいタイルの縁は、隣が細かいタイルならその縁の値、無ければ隣の粗いグリッド、
+        画面の外なら自分の縁の値と比べる。RELAX_EPSILON より小さい変化は捨てるので、
+        落ち着いた所は変わらなくなり、描き直しも止まる。
+        """
+        cols, rows = self.cols, self.rows
+        changed = np.zeros((cols, rows), dtype=bool)
+
+        # 1. 細かいタイル
+        count = self.fine_count
+        if count:
+            fine = self.fine[:count]
+            tx, ty = self.fine_tiles[:count, 0], self.fine_tiles[:count, 1]
+            f = self.fine_div
+            padded = np.empty((count, f + 2, f + 2), dtype=np.float32)
+            padded[:, 1:-1, 1:-1] = fine
+
+            # (隣のセルの向き, 書き込む縁, 自分の縁, 隣のタイルの縁)
+            sides = (
+                (-1, 0, np.s_[:, 0, 1:-1], np.s_[:, 0, :], np.s_[:, -1, :]),
+                (1, 0, np.s_[:, -1, 1:-1], np.s_[:, -1, :], np.s_[:, 0, :]),
+                (0, -1, np.s_[:, 1:-1, 0], np.s_[:, :, 0], np.s_[:, :, -1]),
+                (0, 1, np.s_[:, 1:-1, -1], np.s_[:, :, -1], np.s_[:, :, 0]),
+            )
+            for dx, dy, border, own, theirs in sides:
+                nx, ny = tx + dx, ty + dy
+                inside = (nx >= 0) & (nx < cols) & (ny >= 0) & (ny < rows)
+                nx, ny = np.clip(nx, 0, cols - 1), np.clip(ny, 0, rows - 1)
+                slot = np.where(inside, self.tile_slot[nx, ny], -1)
+                edge = np.where(
+                    inside[:, np.newaxis],
+                    self.grid_angles[nx, ny][:, np.newaxis],
+                    fine[own],
+                )
+                has = slot >= 0
+                edge[has] = self.fine[slot[has]][theirs]
+                padded[border] = edge
+
+            delta = _relax_delta(padded, rate)
+            moving = np.abs(delta) > RELAX_EPSILON
+            fine += np.where(moving, delta, 0.0)
+            moved = np.flatnonzero(moving.any(axis=(1, 2)))
+            if len(moved):
+                self.sync_coarse(moved)
+                changed[tx[moved], ty[moved]] = True
+
+        # 2. 粗いグリッド（細かいタイルのあるセルは上で決まっているので動かさない）
+        padded = np.pad(self.grid_angles, 1, mode="edge")
+        delta = _relax_delta(padded, rate)
+        moving = np.abs(delta) > RELAX_EPSILON
+        moving &= self.tile_slot < 0
+        self.grid_angles += np.where(moving, delta, 0.0)
+        changed |= moving
+
+        xs = np.flatnonzero(changed.any(axis=1))
+        if len(xs):
+            ys = np.flatnonzero(changed.any(axis=0))
+            x0, x1 = int(xs[0]), int(xs[-1]) + 1
+            y0, y1 = int(ys[0]), int(ys[-1]) + 1
+            self.mark_dirty(x0, x1, y0, y1, changed[x0:x1, y0:y1])
+
+    def brush(self, mouse_pos, pmouse_pos):
+        """マウス操作でグリッドの角度を更新（柔らかい円形ブラシ）"""
+        grid_size = self.grid_size
+        mx, my = mouse_pos
+        pmx, pmy = pmouse_pos
+        dx, dy = mx - pmx, my - pmy
+        speed = math.hypot(dx, dy)
+
+        if speed < 1.0:
+            return
+
+        move_angle = math.atan2(dy, dx)
+
+        # 影響範囲のバウンディングボックス（四角枠）を計算
+        # 半径から必要なグリッド数を割り出す
+        range_grid = math.ceil(BRUSH_RADIUS / grid_size) + 1
+
+        gx = int(mx / grid_size)
+        gy = int(my / grid_size)
+
+        min_x = max(0, gx - range_grid)
+        max_x = min(self.cols, gx + range_grid + 1)
+        min_y = max(0, gy - range_grid)
+        max_y = min(self.rows, gy + range_grid + 1)
+
+        if min_x >= max_x or min_y >= max_y:
+            return
+
+        # --- NumPyによる円形ブラシ計算 ---
+
+        # 1. ブラシが触れたセル（セルの四角とマウスの距離が半径未満）を探す
+        # ix は縦ベクトル(N,1), iy は横ベクトル(1,M) の形にする
+        ix = np.arange(min_x, max_x)[:, np.newaxis]
+        iy = np.arange(min_y, max_y)[np.newaxis, :]
+        near_x = np.clip(mx, ix * grid_size, (ix + 1) * grid_size) - mx
+        near_y = np.clip(my, iy * grid_size, (iy + 1) * grid_size) - my
+        touched = near_x**2 + near_y**2 < BRUSH_RADIUS**2
+        tx, ty = np.nonzero(touched)
+        if not len(tx):
+            return
+        tx += min_x
+        ty += min_y
+
+        # 触れたセルには細かいタイルを用意して、そちらの角度を更新する
+        self.alloc_fine_tiles(tx, ty)
+        slots = self.tile_slot[tx, ty]
+
+        # 2. 細かいセルの中心座標(ピクセル)を計算
+        # ブロードキャスト機能で (タイル数, FINE_DIV, FINE_DIV) の形状の座標配列ができる
+        sub = (np.arange(self.fine_div) + 0.5) * self.fine_size
+        grid_pos_x = tx[:, np.newaxis, np.newaxis] * grid_size + sub[:, np.newaxis]
+        grid_pos_y = ty[:, np.newaxis, np.newaxis] * grid_size + sub[np.newaxis, :]
+
+        # 3. マウス位置からの距離を計算
+        dist = np.sqrt((grid_pos_x - mx) ** 2 + (grid_pos_y - my) ** 2)
+
+        # 4. 距離に応じた重み（強さ）を作成
+        # 中心で1.0、半径の位置で0.0になるように滑らかに変化させる
+        # 半径外はマイナスになるので clip で 0 にする
+        brush_weight = 1.0 - (dist / BRUSH_RADIUS)
+        brush_weight = np.clip(brush_weight, 0.0, 1.0)
+
+        # 5. 角度更新の適用
+        # 対象エリアの現在の角度を取得
+        target_area = self.fine[slots]
+
+        # 角度差を計算
+        diff = _wrap_angle(move_angle - target_area)  # -PI ~ PI に正規化
+
+        # 更新量を計算： 角度差 * 基本強度 * 場所ごとの重み
+        # これにより、中心ほど強く、外側ほど弱く角度が変わる
+        update_amount = diff * BRUSH_STRENGTH * brush_weight
+
+        # 更新適用（粗いグリッドにも平均の向きを書き戻す）
+        self.fine[slots] = target_area + update_amount
+        self.sync_coarse(slots)
+
+        # 角度が変わったセルは描き直す
+        changed = np.zeros((max_x - min_x, max_y - min_y), dtype=bool)
+        changed[tx - min_x, ty - min_y] = (update_amount != 0).any(axis=(1, 2))
+        self.mark_dirty(min_x, max_x, min_y, max_y, changed)
+
+    def draw_hairs(self, surface, mode=None, hairs=slice(None), clip=None):
+        """計算と描画
+
+        mode="numpy" は HairRasterizer で画素配列に直接書き込む（書き込めない
+        surface なら pygame の描画に戻る）。
+        mode="pygame" は今まで通り pygame.draw.line を1本ずつ呼ぶ。
+        hairs で描く毛（番号の配列）、clip で描く範囲を絞れる。
+        """
+        if mode is None:
+            mode = self.mode
+        if mode == "numpy" and self.rasterizer.supports(surface):
+            self._draw_hairs_numpy(surface, hairs, clip)
+            return
+
+        pos = self.hair_pos[hairs]
+        lengths = self.hair_lengths[hairs]
+
+        # 1. 座標計算（読む場所は前計算済みなので gather するだけ）
+        angles = self.angle_table[self.hair_field[hairs]]
+        draw_angles = angles + self.hair_jitter[hairs]
+
+        cos_a = np.cos(draw_angles)
+        sin_a = np.sin(draw_angles)
+
+        # 2. 色計算
+        factor = (-cos_a + 1.0) / 2.0
+        factor = np.clip(factor, 0.0, 1.0)
+
+        factor_exp = factor[:, np.newaxis]
+        colors = COLOR_DARK + (COLOR_LIGHT - COLOR_DARK) * factor_exp
+        colors += self.hair_color_vars[hairs, np.newaxis]
+
+        colors_int = np.clip(colors, 0, 255).astype(np.uint8)
+
+        # 3. 描画
+        ends = self.end_pos[: len(pos)]
+        ends[:, 0] = pos[:, 0] + cos_a * lengths
+        ends[:, 1] = pos[:, 1] + sin_a * lengths
+
+        # draw.line は端で切られると線の画素が変わるので、clip があるときは
+        # 2セル分広い下書きに描いて clip の範囲だけ写す（画面の端では同じように切れる）
+        target = surface
+        if clip is not None:
+            margin = self.grid_size * 2
+            draft = clip.inflate(margin * 2, margin * 2).clip(surface.get_rect())
+            target = pygame.Surface(draft.size)
+            target.fill(BG_COLOR)
+            pos = pos - draft.topleft
+            ends = ends - draft.topleft
+
+        # Pythonリストへ変換
+        starts_list = pos.tolist()
+        ends_list = ends.tolist()
+        colors_list = colors_int.tolist()
+
+        target.lock()
+        for i in range(len(pos)):
+            pygame.draw.line(target, colors_list[i], starts_list[i], ends_list[i], 1)
+        target.unlock()
+
+        if clip is not None:
+            surface.blit(target, clip, clip.move(-draft.left, -draft.top))
+
+    def _draw_hairs_numpy(self, surface, hairs, clip):
+        """draw_hairs の numpy 版（角度・色は pygame 版と同じ式）
+
+        線は角度を ANGLE_BINS 段階に丸めた DDA で引くので、draw.line とは
+        画素単位で少しずれる（見た目はほぼ同じだが、結果は一致しない）。
+        """
+        draw_hair_arrays(
+            surface,
+            self.hair_arrays,
+            self.angle_table,
+            self.rasterizer,
+            self.scratch,
+            hairs,
+            clip,
+        )
+
+    def hairs_in_cells(self, x0, x1, y0, y1):
+        """セル [x0, x1) x [y0, y1) に根元がある毛の番号（番号順）
+
+        1列(gx)の中ではセル番号が連続しているので、CSR から列ごとに
+        切り出してつなげるだけで済む。
+        """
+        rows, start = self.rows, self.cell_start
+        ranges = [
+            (int(start[gx * rows + y0]), int(start[gx * rows + y1]))
+            for gx in range(x0, x1)
+        ]
+        total = sum(b - a for a, b in ranges)
+        hairs = self.scratch.get("hairs", (total,), np.intp)
+        np.concatenate([self.cell_hairs[a:b] for a, b in ranges], out=hairs)
+        hairs.sort()  # 描く順番（重なり）を全体を描いた時と同じにする
+        return hairs
+
+    def redraw(self, mode=None):
+        """dirty_cells の周りだけ layer を描き直す（何も変わっていなければ何もしない）
+
+        毛は長くても GRID_SIZE より短いので、セルの毛がはみ出すのは隣のセルまで。
+        そこで「変わったセル + 隣」を dirty_boxes の矩形ごとに地の色で消し、
+        その矩形に届きうる毛（さらに隣のセルまで）を番号順に描き直す。
+        """
+        if not self.dirty_cells.any():
+            return
+        for box in self.dirty_boxes():
+            self._redraw_box(mode, *box)
+        self.dirty_cells[:] = False
+
+    def _redraw_box(self, mode, x0, x1, y0, y1):
+        """セル [x0, x1) x [y0, y1) の矩形を地の色で消して描き直す"""
+        cols, rows, grid_size = self.cols, self.rows, self.grid_size
+        area = pygame.Rect(
+            x0 * grid_size,
+            y0 * grid_size,
+            (x1 - x0) * grid_size,
+            (y1 - y0) * grid_size,
+        ).clip(self.layer.get_rect())
 
-# --- 初期化 ---
-pygame.init()
-screen = pygame.display.set_mode((WINDOW_W, WINDOW_H))
-pygame.display.set_caption("Python Velvet Simulator - Soft Brush")
-clock = pygame.time.Clock()
+        # 矩形に届きうる毛 = 矩形のセルからさらに1セル外までに根元がある毛
+        if x0 <= 1 and y0 <= 1 and x1 >= cols - 1 and y1 >= rows - 1:
+            hairs = slice(None)  # 全部
+        else:
+            hairs = self.hairs_in_cells(
+                max(x0 - 1, 0), min(x1 + 1, cols), max(y0 - 1, 0), min(y1 + 1, rows)
+            )
 
-# --- データ準備 ---
-cols = math.ceil(WINDOW_W / GRID_SIZE)
-rows = math.ceil(WINDOW_H / GRID_SIZE)
+        self.layer.fill(BG_COLOR, area)
+        self.draw_hairs(self.layer, mode, hairs, area)
 
-# グリッドの角度（初期化）
-grid_angles = (np.random.rand(cols, rows) * 0.5 - 0.25).astype(np.float32)
+    def render_into(self, surface, dest=(0, 0)):
+        """変わった所だけ描き直してから、レイヤーを surface の dest に blit する"""
+        if self.layer is None:
+            self.layer = pygame.Surface((self.width, self.height), 0, surface)
+            self.invalidate()
+        self.redraw()
+        surface.blit(self.layer, dest)
 
-# 毛のデータ
-hair_pos = np.random.rand(HAIR_COUNT, 2).astype(np.float32)
-hair_pos[:, 0] *= WINDOW_W
-hair_pos[:, 1] *= WINDOW_H
 
-hair_props = np.random.rand(HAIR_COUNT, 2).astype(np.float32)
-hair_lengths = (hair_props[:, 0] * 0.4 + 0.8) * HAIR_LENGTH
-hair_color_vars = (hair_props[:, 1] - 0.5) * 40.0
+# 子プロセスの中の状態（_render_worker_init で作る）
+_worker = None
 
-# 計算用バッファ
-end_pos = np.zeros((HAIR_COUNT, 2), dtype=np.float32)
 
+def _render_worker_init(spec, width, height, draft_size, scratch):
+    """ParallelHairRenderer の子プロセスで1回だけ呼ばれ、共有メモリを開く"""
+    global _worker
+    blocks = {}
+    arrays = {}
+    for name, (shm_name, shape, dtype) in spec.items():
+        blocks[name] = shared_memory.SharedMemory(name=shm_name)
+        arrays[name] = np.ndarray(shape, dtype, buffer=blocks[name].buf)
+    frame = pygame.image.frombuffer(blocks["frame"].buf, (width, height), "RGBX")
+    _worker = {
+        "blocks": blocks,
+        "arrays": arrays,
+        "hair_arrays": {
+            name: arrays[name]
+            for name in ("pos", "lengths", "field", "jitter", "color_vars")
+        },
+        # タイルより毛2本分ずつ広い下書き（フレームと同じ画素形式）
+        "draft": pygame.Surface(draft_size, 0, frame),
+        "rasterizer": HairRasterizer(*draft_size, HAIR_LENGTH * 1.2),
+        "scratch": ScratchBuffers(enabled=scratch),
+    }
 
-# --- 【重要】ここが修正された関数です ---
-def update_grid_soft(mouse_pos, pmouse_pos):
-    """マウス操作でグリッドの角度を更新（柔らかい円形ブラシ）"""
-    mx, my = mouse_pos
-    pmx, pmy = pmouse_pos
-    dx, dy = mx - pmx, my - pmy
-    speed = math.hypot(dx, dy)
 
-    if speed < 1.0:
-        return
+def _render_tile(tile):
+    """タイル1枚に届く毛を番号順に下書きへ描き、タイルの所だけフレームへ写す
 
-    move_angle = math.atan2(dy, dx)
+    下書きはタイルの周りに毛2本分の余白があるので、描く毛（根元がタイルから
+    毛1本分以内）ははみ出さず、clip の判定をせずに描ける（子プロセスで動く）。
+    """
+    arrays = _worker["arrays"]
+    draft = _worker["draft"]
+    start, end = arrays["tile_start"][tile], arrays["tile_start"][tile + 1]
+    left, top, right, bottom = arrays["tile_rect"][tile].tolist()
+    margin = _worker["rasterizer"].max_length * 2
+    origin = (left - margin, top - margin)
 
-    # 影響範囲のバウンディングボックス（四角枠）を計算
-    # 半径から必要なグリッド数を割り出す
-    range_grid = math.ceil(BRUSH_RADIUS / GRID_SIZE) + 1
+    draft.fill(BG_COLOR)
+    draw_hair_arrays(
+        draft,
+        _worker["hair_arrays"],
+        arrays["angle_table"],
+        _worker["rasterizer"],
+        _worker["scratch"],
+        arrays["tile_hairs"][start:end],
+        origin=origin,
+    )
 
-    gx = int(mx / GRID_SIZE)
-    gy = int(my / GRID_SIZE)
+    pixels = pygame.surfarray.pixels2d(draft)  # (w, h) の向き
+    arrays["frame"][top:bottom, left:right] = pixels[
+        margin : margin + right - left, margin : margin + bottom - top
+    ].T
+    del pixels  # ロック解除
 
-    min_x = max(0, gx - range_grid)
-    max_x = min(cols, gx + range_grid + 1)
-    min_y = max(0, gy - range_grid)
-    max_y = min(rows, gy + range_grid + 1)
 
-    if min_x >= max_x or min_y >= max_y:
-        return
+class ParallelHairRenderer:
+    """VelvetSimulator をタイルに分け、変わったタイルを子プロセスで並列に描く
 
-    # --- NumPyによる円形ブラシ計算 ---
+    フレームバッファは共有メモリ（multiprocessing.shared_memory）に置き、
+    子プロセスは毛の角度・色の計算から描画までをして、自分のタイルの所に書き込む。
+    タイルは重ならないので書き込みはぶつからず、親プロセスは角度を共有メモリに
+    写して待ち、できたフレームを blit するだけ。
+    描き方は numpy 描画だけ（R キーの切り替えは効かない）。
 
-    # 1. 切り出した範囲のグリッドインデックス配列を作成
-    # ix は縦ベクトル(N,1), iy は横ベクトル(1,M) の形にする
-    ix = np.arange(min_x, max_x)[:, np.newaxis]
-    iy = np.arange(min_y, max_y)[np.newaxis, :]
+    VelvetSimulator.render_into の代わりに render_into を呼び、終わったら close() する。
+    workers が None なら CPU の数だけ子プロセスを作る。
+    """
 
-    # 2. 各グリッドの中心座標(ピクセル)を計算
-    # ブロードキャスト機能で (N, M) の形状の座標配列ができる
-    grid_pos_x = ix * GRID_SIZE + GRID_SIZE / 2
-    grid_pos_y = iy * GRID_SIZE + GRID_SIZE / 2
+    def __init__(self, velvet, workers=None, tile_cells=RENDER_TILE_CELLS):
+        self.velvet = velvet
+        cols, rows, grid_size = velvet.cols, velvet.rows, velvet.grid_size
+        width, height = velvet.width, velvet.height
+        reach = velvet.rasterizer.max_length
+        px, py = velvet.hair_pos[:, 0], velvet.hair_pos[:, 1]
 
-    # 3. マウス位置からの距離を計算
-    dist = np.sqrt((grid_pos_x - mx) ** 2 + (grid_pos_y - my) ** 2)
+        # タイル（セルの範囲と画素の矩形 left, top, right, bottom）と、
+        # タイルに届きうる毛（根元がタイルから毛1本分以内。番号順）
+        cells, rects, hairs = [], [], []
+        for y0 in range(0, rows, tile_cells):
+            for x0 in range(0, cols, tile_cells):
+                x1, y1 = min(x0 + tile_cells, cols), min(y0 + tile_cells, rows)
+                cells.append((x0, x1, y0, y1))
+                left, top = x0 * grid_size, y0 * grid_size
+                right = min(x1 * grid_size, width)
+                bottom = min(y1 * grid_size, height)
+                rects.append((left, top, right, bottom))
 
-    # 4. 距離に応じた重み（強さ）を作成
-    # 中心で1.0、半径の位置で0.0になるように滑らかに変化させる
-    # 半径外はマイナスになるので clip で 0 にする
-    brush_weight = 1.0 - (dist / BRUSH_RADIUS)
-    brush_weight = np.clip(brush_weight, 0.0, 1.0)
+                near = velvet.hairs_in_cells(
+                    max(x0 - 1, 0), min(x1 + 1, cols), max(y0 - 1, 0), min(y1 + 1, rows)
+                )
+                x, y = px[near], py[near]
+                inside = (x >= left - reach) & (x < right + reach)
+                inside &= (y >= top - reach) & (y < bottom + reach)
+                hairs.append(near[inside])
+        self.tile_cells = np.array(cells, dtype=np.int32)
+        tile_start = np.zeros(len(hairs) + 1, dtype=np.intp)
+        np.cumsum([len(h) for h in hairs], out=tile_start[1:])
 
-    # 5. 角度更新の適用
-    # 対象エリアの現在の角度を取得
-    target_area = grid_angles[min_x:max_x, min_y:max_y]
+        # 共有メモリ（角度の表は細かいタイルが全部埋まった時の大きさで取っておく）
+        table_size = cols * rows * (1 + velvet.fine_div**2)
+        self.blocks = {}
+        self.arrays = {}
+        self._share("frame", (height, width), np.uint32)
+        self._share("angle_table", (table_size,), np.float32)
+        for name, src in velvet.hair_arrays.items():
+            self._share(name, src.shape, src.dtype)[...] = src
+        self._share("tile_hairs", (int(tile_start[-1]),), np.intp)[...] = (
+            np.concatenate(hairs)
+        )
+        self._share("tile_start", tile_start.shape, np.intp)[...] = tile_start
+        self._share("tile_rect", (len(rects), 4), np.int32)[...] = rects
+        self.synced_fine_count = velvet.fine_count
 
-    # 角度差を計算
-    diff = move_angle - target_area
-    diff = (diff + np.pi) % (2 * np.pi) - np.pi  # -PI ~ PI に正規化
+        self.surface = pygame.image.frombuffer(
+            self.blocks["frame"].buf, (width, height), "RGBX"
+        )
+        spec = {
+            name: (self.blocks[name].name, array.shape, array.dtype.str)
+            for name, array in self.arrays.items()
+        }
+        draft_size = (
+            tile_cells * grid_size + reach * 4,
+            tile_cells * grid_size + reach * 4,
+        )
+        # fork だと pygame/SDL の状態ごと複製されるので、子プロセスは spawn で作る
+        self.pool = multiprocessing.get_context("spawn").Pool(
+            workers,
+            _render_worker_init,
+            (spec, width, height, draft_size, velvet.scratch.enabled),
+        )
+        velvet.invalidate()
 
-    # 更新量を計算： 角度差 * 基本強度 * 場所ごとの重み
-    # これにより、中心ほど強く、外側ほど弱く角度が変わる
-    update_amount = diff * BRUSH_STRENGTH * brush_weight
+    def _share(self, name, shape, dtype):
+        """共有メモリに配列を作る"""
+        size = max(math.prod(shape) * np.dtype(dtype).itemsize, 1)
+        block = self.blocks[name] = shared_memory.SharedMemory(create=True, size=size)
+        array = self.arrays[name] = np.ndarray(shape, dtype, buffer=block.buf)
+        return array
 
-    # 更新適用
-    grid_angles[min_x:max_x, min_y:max_y] += update_amount
+    def render_into(self, surface, dest=(0, 0)):
+        """変わったタイルを子プロセスで描き直してから、フレームを surface の dest に blit する"""
+        velvet = self.velvet
+        if velvet.dirty_cells.any():
+            # 変わったセルか、その隣のセルを含むタイルだけ描き直す
+            halo = velvet.dirty_halo()
+            tiles = [
+                tile
+                for tile, (x0, x1, y0, y1) in enumerate(self.tile_cells.tolist())
+                if halo[x0:x1, y0:y1].any()
+            ]
 
+            # 角度は毎回、毛が読む場所は細かいタイルが増えた時だけ写す
+            table = velvet.angle_table
+            self.arrays["angle_table"][: len(table)] = table
+            if velvet.fine_count != self.synced_fine_count:
+                self.arrays["field"][...] = velvet.hair_field
+                self.synced_fine_count = velvet.fine_count
 
-def draw_hairs(surface):
-    """計算と描画（前回と同じ）"""
+            self.pool.map(_render_tile, tiles, chunksize=1)
+            velvet.dirty_cells[:] = False
+        surface.blit(self.surface, dest)
 
-    # 1. 座標計算
-    grid_indices_x = (hair_pos[:, 0] / GRID_SIZE).astype(int)
-    grid_indices_y = (hair_pos[:, 1] / GRID_SIZE).astype(int)
-    np.clip(grid_indices_x, 0, cols - 1, out=grid_indices_x)
-    np.clip(grid_indices_y, 0, rows - 1, out=grid_indices_y)
+    def close(self):
+        """子プロセスを止めて共有メモリを解放する"""
+        self.pool.close()
+        self.pool.join()
+        # 共有メモリを指している配列と surface を先に手放す
+        self.surface = None
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
 
-    angles = grid_angles[grid_indices_x, grid_indices_y]
-    draw_angles = angles + (hair_props[:, 1] - 0.5) * 0.2
 
-    cos_a = np.cos(draw_angles)
-    sin_a = np.sin(draw_angles)
+def measure_allocations(velvet, surface, frames=10):
+    """全体を描き直すフレームを frames 回描き、1フレームの描画中に一時的に増えたメモリの
+    最大値 (peak_bytes_per_frame) を測る
 
-    end_pos[:, 0] = hair_pos[:, 0] + cos_a * hair_lengths
-    end_pos[:, 1] = hair_pos[:, 1] + sin_a * hair_lengths
+    USE_SCRATCH_BUFFERS なら NumPy の内部バッファ程度で、毛の本数によらず一定になる
+    （使い回さなければ毛の本数に比例する）。tracemalloc のスナップショットは
+    生きている割り当てしか見えず、途中で作って捨てた配列の数は数えられないので、
+    割り当ての回数ではなくこの最大値で見る。
+    1回目は作業用配列や NumPy 内部のキャッシュを確保するので、
+    トレースを始めてから1フレーム描いた後で計測を始める。
+    """
+    velvet.invalidate()
+    velvet.render_into(surface)
 
-    # 2. 色計算
-    factor = (-cos_a + 1.0) / 2.0
-    factor = np.clip(factor, 0.0, 1.0)
+    tracemalloc.start()
+    velvet.invalidate()
+    velvet.render_into(surface)
+    peak = 0
+    for _ in range(frames):
+        velvet.invalidate()
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        velvet.render_into(surface)
+        _, top = tracemalloc.get_traced_memory()
+        peak = max(peak, top - start)
+    tracemalloc.stop()
+    return {"peak_bytes_per_frame": peak}
 
-    factor_exp = factor[:, np.newaxis]
-    colors = COLOR_DARK + (COLOR_LIGHT - COLOR_DARK) * factor_exp
-    colors += hair_color_vars[:, np.newaxis]
 
-    colors_int = np.clip(colors, 0, 255).astype(np.uint8)
+def check_allocations(hair_counts=(2000, 20000), frames=5, tolerance=1.1):
+    """毛の本数を変えて measure_allocations し、一時メモリが本数で増えないことを確かめる
 
-    # Pythonリストへ変換
-    starts_list = hair_pos.tolist()
-    ends_list = end_pos.tolist()
-    colors_list = colors_int.tolist()
+    一番少ない本数の peak_bytes_per_frame の tolerance 倍を超えたら AssertionError。
+    テストや CI から呼ぶ用（ウィンドウは開かない）。本数ごとの結果を返す。
+    """
+    surface = pygame.Surface((WINDOW_W, WINDOW_H))
+    results = {}
+    for count in hair_counts:
+        velvet = VelvetSimulator(hair_count=count, seed=0, scratch=True)
+        results[count] = measure_allocations(velvet, surface, frames)
 
-    # 3. 描画ループ
-    surface.lock()
-    for i in range(HAIR_COUNT):
-        pygame.draw.line(surface, colors_list[i], starts_list[i], ends_list[i], 1)
-    surface.unlock()
+    limit = results[min(hair_counts)]["peak_bytes_per_frame"] * tolerance
+    for count, result in results.items():
+        assert result["peak_bytes_per_frame"] <= limit, (
+            f"{count} 本で1フレームの一時メモリが {result['peak_bytes_per_frame']} バイト"
+            f"（{min(hair_counts)} 本の {tolerance} 倍 = {limit:.0f} バイトを超えた）"
+        )
+    return results
 
 
-# --- メインループ ---
-running = True
-last_mouse_pos = pygame.mouse.get_pos()
+def main():
+    pygame.init()
+    screen = pygame.display.set_mode((WINDOW_W, WINDOW_H))
+    pygame.display.set_caption("Python Velvet Simulator - Soft Brush")
+    clock = pygame.time.Clock()
+    inputs = input_trace.open_input()
 
-while running:
-    # 背景クリア
-    screen.fill((15, 30, 45))
+    velvet = VelvetSimulator()
+    # RENDER_WORKERS があればタイルごとに子プロセスで描く（こちらは blit するだけ）
+    renderer = (
+        ParallelHairRenderer(velvet, RENDER_WORKERS) if RENDER_WORKERS else velvet
+    )
 
-    # イベント処理
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
+    # --- メインループ ---
+    running = True
+    while running:
+        # イベント処理
+        for event in inputs.get_events():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_r:
+                # R キーで描画方式を切り替える（見比べ用）
+                velvet.mode = "pygame" if velvet.mode == "numpy" else "numpy"
+                velvet.invalidate()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_d:
+                # D キーで毛並みのなじみを切り替える
+                velvet.relax = not velvet.relax
 
-    # マウス処理
-    current_mouse_pos = pygame.mouse.get_pos()
-    mouse_pressed = pygame.mouse.get_pressed()[0]
+        # マウス処理
+        velvet.step(inputs.get_pos(), inputs.get_pressed()[0])
 
-    if mouse_pressed:
-        # 新しい関数を呼び出す
-        update_grid_soft(current_mouse_pos, last_mouse_pos)
+        # 描画（誰も触っていなければ描き溜めたレイヤーを1回blitするだけ）
+        renderer.render_into(screen)
 
-    last_mouse_pos = current_mouse_pos
+        pygame.display.flip()
+        inputs.tick(clock, 60)
 
-    # 描画
-    draw_hairs(screen)
+    if renderer is not velvet:
+        renderer.close()
+    pygame.quit()
 
-    pygame.display.flip()
-    clock.tick(60)
 
-pygame.quit()
-sys.exit()
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 import pygame
 import math
 import random
+from collections import OrderedDict
+
+import numpy as np
+
+import input_trace
 
 # --- 設定パラメータ ---
 WIDTH, HEIGHT = 800, 600
@@ -19,40 +24,130 @@ POP_THRESHOLD = 1.0  # 破裂閾値
 PRESSURE_SPEED = 0.04  # 押し込む速さ（少しゆっくりにして溜め感アップ）
 RECOVERY_SPEED = 0.1  # 戻る速さ
 
-
-class Particle:
-    """弾けた時の破片"""
-
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        angle = random.uniform(0, math.pi * 2)
-        speed = random.uniform(2, 8)
-        self.vx = math.cos(angle) * speed
-        self.vy = math.sin(angle) * speed
-        self.life = 255
-        self.size = random.randint(2, 5)
+# 描画設定
+PRESSURE_LEVELS = 64  # 圧力を何段階の画像にするか
+
+# 無限シート設定
+CHUNK_ROWS = 8  # チャンク1つの行数
+CHUNK_COLS = 8  # チャンク1つの列数
+MAX_LOADED_CHUNKS = 32  # メモリに置いておくチャンクの上限（超えたら古いものから捨てる）
+SCROLL_SPEED = 12  # 矢印キーでのスクロール速度(px/フレーム)
+WHEEL_STEP = 40  # ホイール1目盛りのスクロール量(px)
+
+# パーティクル設定
+PARTICLE_CAPACITY = 1024  # 同時に存在できる破片の上限（超えたら古いものから消える）
+PARTICLES_PER_POP = 12  # 1回の破裂で飛ぶ破片の数
+PARTICLE_LIFE = 255  # 寿命（= 最初のアルファ値）
+PARTICLE_FADE = 15  # 1フレームで減る寿命
+PARTICLE_COLOR = (200, 220, 255)
+
+
+class ParticlePool:
+    """弾けた時の破片（配列でまとめて管理する固定容量プール）
+
+    破片ごとにオブジェクトやSurfaceを作らず、x, y, vx, vy, life, size を
+    NumPy配列で持つ。生きている破片は常に配列の先頭 [0:count] に詰めておく。
+    """
+
+    def __init__(self, capacity=PARTICLE_CAPACITY):
+        self.capacity = capacity
+        self.count = 0
+
+        self.x = np.zeros(capacity, dtype=np.float32)
+        self.y = np.zeros(capacity, dtype=np.float32)
+        self.vx = np.zeros(capacity, dtype=np.float32)
+        self.vy = np.zeros(capacity, dtype=np.float32)
+        self.life = np.zeros(capacity, dtype=np.int16)
+        self.size = np.zeros(capacity, dtype=np.int16)
+
+        self._arrays = (self.x, self.y, self.vx, self.vy, self.life, self.size)
+
+        # 大きさ x 寿命（アルファ）ごとの画像を先に作っておく
+        # 寿命は PARTICLE_FADE ずつしか減らないので、段階の数は決まっている
+        self.sprites = {}
+        for size in range(2, 6):
+            for life in range(PARTICLE_LIFE, 0, -PARTICLE_FADE):
+                s = pygame.Surface((size * 2, size * 2), pygame.SRCALPHA)
+                pygame.draw.circle(s, (*PARTICLE_COLOR, life), (size, size), size)
+                self.sprites[(size, life)] = s
+
+    def emit(self, x, y, n=PARTICLES_PER_POP):
+        """(x, y) から n 個の破片を飛ばす"""
+        n = min(n, self.capacity)
+
+        # 満杯なら古い破片（配列の先頭）から捨てる
+        overflow = self.count + n - self.capacity
+        if overflow > 0:
+            keep = self.count - overflow
+            for arr in self._arrays:
+                arr[:keep] = arr[overflow : self.count]
+            self.count = keep
+
+        angle = np.random.uniform(0, math.pi * 2, n)
+        speed = np.random.uniform(2, 8, n)
+
+        i, j = self.count, self.count + n
+        self.x[i:j] = x
+        self.y[i:j] = y
+        self.vx[i:j] = np.cos(angle) * speed
+        self.vy[i:j] = np.sin(angle) * speed
+        self.life[i:j] = PARTICLE_LIFE
+        self.size[i:j] = np.random.randint(2, 6, n)
+        self.count = j
 
     def update(self):
-        self.x += self.vx
-        self.y += self.vy
-        self.vy += 0.5  # 重力
-        self.life -= 15  # フェードアウト
-
-    def draw(self, screen):
-        if self.life > 0:
-            s = pygame.Surface((self.size * 2, self.size * 2), pygame.SRCALPHA)
-            pygame.draw.circle(
-                s, (200, 220, 255, max(0, self.life)), (self.size, self.size), self.size
-            )
-            screen.blit(s, (self.x - self.size, self.y - self.size))
+        n = self.count
+        self.x[:n] += self.vx[:n]
+        self.y[:n] += self.vy[:n]
+        self.vy[:n] += 0.5  # 重力
+        self.life[:n] -= PARTICLE_FADE  # フェードアウト
+
+        # 消えた破片を詰める
+        alive = self.life[:n] > 0
+        k = int(np.count_nonzero(alive))
+        if k < n:
+            for arr in self._arrays:
+                arr[:k] = arr[:n][alive]
+            self.count = k
+
+    def bounds(self):
+        """全破片を囲む矩形（破片が無ければ None）"""
+        n = self.count
+        if n == 0:
+            return None
+
+        size = self.size[:n]
+        left = int(np.floor((self.x[:n] - size).min()))
+        top = int(np.floor((self.y[:n] - size).min()))
+        right = int(np.ceil((self.x[:n] + size).max())) + 1
+        bottom = int(np.ceil((self.y[:n] + size).max())) + 1
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def draw(self, screen, camera=(0, 0)):
+        n = self.count
+        if n == 0:
+            return
+
+        sizes = self.size[:n].tolist()
+        lives = self.life[:n].tolist()
+        xs = (self.x[:n] - self.size[:n] - camera[0]).tolist()
+        ys = (self.y[:n] - self.size[:n] - camera[1]).tolist()
+
+        sprites = self.sprites
+        screen.blits(
+            [
+                (sprites[(size, life)], (x, y))
+                for size, life, x, y in zip(sizes, lives, xs, ys)
+            ],
+            doreturn=False,
+        )
 
 
 class Bubble:
-    def __init__(self, x, y):
+    def __init__(self, x, y, radius=BUBBLE_RADIUS):
         self.x = x
         self.y = y
-        self.radius = BUBBLE_RADIUS
+        self.radius = radius
 
         self.pressure = 0.0  # 現在の圧力 (0.0 ~ 1.0)
         self.is_popped = False
@@ -101,73 +196,410 @@ class Bubble:
         self.shake_x = 0
         self.shake_y = 0
 
-    def draw(self, screen):
+    def draw(self, screen, camera=(0, 0)):
         cx = int(self.x + self.shake_x)
         cy = int(self.y + self.shake_y)
 
+        atlas = get_bubble_atlas(self.radius)
         if self.is_popped:
-            # --- 潰れた状態 ---
-            pygame.draw.circle(screen, COLOR_POPPED, (cx, cy), self.radius)
-            # シワ
-            pygame.draw.arc(
-                screen, (40, 50, 60), (cx - 15, cy - 15, 30, 30), 0, 3.14, 2
-            )
-            pygame.draw.line(screen, (40, 50, 60), (cx - 10, cy), (cx + 10, cy + 5), 2)
+            img = atlas.popped
         else:
-            # --- 生きている状態 ---
-
-            # 変形
-            squish = self.pressure * 4
-
-            # ★ここが修正ポイント：色の計算結果を整数(int)にする
-            # floatのままだとエラーになるため変換
-            base_c = tuple(
-                min(255, max(0, int(c + (s - c) * self.pressure)))
-                for c, s in zip(COLOR_BUBBLE_BASE, COLOR_STRESS)
-            )
-
-            # 本体
-            pygame.draw.circle(screen, base_c, (cx, cy), int(self.radius + squish))
-
-            # 影（右下）
-            # 半透明を描くためにSurfaceを使う
-            s_shadow = pygame.Surface(
-                (self.radius * 2 + 10, self.radius * 2 + 10), pygame.SRCALPHA
-            )
-            pygame.draw.circle(
-                s_shadow,
-                (0, 0, 0, 40),
-                (self.radius + 5, self.radius + 5),
-                self.radius,
-                width=2,
-            )
-            screen.blit(s_shadow, (cx - self.radius - 5, cy - self.radius - 5))
-
-            # 凹み影（中心）
-            if self.pressure > 0.1:
-                shadow_radius = int(self.radius * 0.8 * self.pressure)
-                if shadow_radius > 0:
-                    s = pygame.Surface(
-                        (shadow_radius * 2, shadow_radius * 2), pygame.SRCALPHA
-                    )
-                    alpha = int(100 * self.pressure)
-                    pygame.draw.circle(
-                        s,
-                        (0, 0, 0, alpha),
-                        (shadow_radius, shadow_radius),
-                        shadow_radius,
-                    )
-                    screen.blit(s, (cx - shadow_radius, cy - shadow_radius))
+            img = atlas.image_for(self.pressure)
+        screen.blit(img, (cx - atlas.half - camera[0], cy - atlas.half - camera[1]))
 
-            # ハイライト（光沢）
-            hl_offset = 10 * (1.0 - self.pressure * 0.5)
-            hl_pos_x = cx - hl_offset
-            hl_pos_y = cy - hl_offset
-            hl_radius = 8 + squish
+    def draw_state(self):
+        """見た目を決める値（これが変わらなければ描き直す必要はない）"""
+        cx = int(self.x + self.shake_x)
+        cy = int(self.y + self.shake_y)
+        level = -1 if self.is_popped else round(self.pressure * (PRESSURE_LEVELS - 1))
+        return (cx, cy, level)
+
+    def bounds(self):
+        """シェイク・変形込みで描画される範囲"""
+        cx, cy, _ = self.draw_state()
+        half = self.radius + 6  # BubbleAtlas.half と同じ
+        return pygame.Rect(cx - half, cy - half, half * 2, half * 2)
+
+
+class BubbleAtlas:
+    """圧力を量子化した段階ごとのプチプチ画像（＋潰れた後の画像）
+
+    描画は圧力だけで決まるので、PRESSURE_LEVELS 段階ぶん先に描いておけば
+    毎フレームは1回blitするだけで済む。
+    """
+
+    def __init__(self, radius):
+        self.radius = radius
+        # 変形・影・ハイライトが全部収まる大きさ（中心は (half, half)）
+        self.half = radius + 6
+        self.levels = [
+            self.render_bubble(i / (PRESSURE_LEVELS - 1))
+            for i in range(PRESSURE_LEVELS)
+        ]
+        self.popped = self.render_popped()
+
+    def image_for(self, pressure):
+        level = round(pressure * (PRESSURE_LEVELS - 1))
+        return self.levels[min(PRESSURE_LEVELS - 1, max(0, level))]
+
+    def new_surface(self):
+        size = self.half * 2
+        return pygame.Surface((size, size), pygame.SRCALPHA)
+
+    def render_popped(self):
+        surf = self.new_surface()
+        cx = cy = self.half
+
+        # --- 潰れた状態 ---
+        pygame.draw.circle(surf, COLOR_POPPED, (cx, cy), self.radius)
+        # シワ
+        pygame.draw.arc(surf, (40, 50, 60), (cx - 15, cy - 15, 30, 30), 0, 3.14, 2)
+        pygame.draw.line(surf, (40, 50, 60), (cx - 10, cy), (cx + 10, cy + 5), 2)
+        return surf
+
+    def render_bubble(self, pressure):
+        surf = self.new_surface()
+        cx = cy = self.half
+        radius = self.radius
+
+        # --- 生きている状態 ---
+
+        # 変形
+        squish = pressure * 4
+
+        # ★ここが修正ポイント：色の計算結果を整数(int)にする
+        # floatのままだとエラーになるため変換
+        base_c = tuple(
+            min(255, max(0, int(c + (s - c) * pressure)))
+            for c, s in zip(COLOR_BUBBLE_BASE, COLOR_STRESS)
+        )
+
+        # 本体
+        pygame.draw.circle(surf, base_c, (cx, cy), int(radius + squish))
+
+        # 影（右下）
+        # 半透明を描くためにSurfaceを使う
+        s_shadow = pygame.Surface((radius * 2 + 10, radius * 2 + 10), pygame.SRCALPHA)
+        pygame.draw.circle(
+            s_shadow,
+            (0, 0, 0, 40),
+            (radius + 5, radius + 5),
+            radius,
+            width=2,
+        )
+        surf.blit(s_shadow, (cx - radius - 5, cy - radius - 5))
+
+        # 凹み影（中心）
+        if pressure > 0.1:
+            shadow_radius = int(radius * 0.8 * pressure)
+            if shadow_radius > 0:
+                s = pygame.Surface(
+                    (shadow_radius * 2, shadow_radius * 2), pygame.SRCALPHA
+                )
+                alpha = int(100 * pressure)
+                pygame.draw.circle(
+                    s,
+                    (0, 0, 0, alpha),
+                    (shadow_radius, shadow_radius),
+                    shadow_radius,
+                )
+                surf.blit(s, (cx - shadow_radius, cy - shadow_radius))
+
+        # ハイライト（光沢）
+        hl_offset = 10 * (1.0 - pressure * 0.5)
+        hl_pos_x = cx - hl_offset
+        hl_pos_y = cy - hl_offset
+        hl_radius = 8 + squish
+
+        s_hl = pygame.Surface((40, 40), pygame.SRCALPHA)
+        pygame.draw.circle(s_hl, (*COLOR_HIGHLIGHT, 180), (20, 20), hl_radius)
+        surf.blit(s_hl, (hl_pos_x - 20, hl_pos_y - 20))
+
+        return surf
+
+
+_atlases = {}  # radius -> BubbleAtlas
+
+
+def get_bubble_atlas(radius):
+    """半径ごとのアトラスを返す（初回だけ作る。pygame.init() の後に呼ぶこと）"""
+    atlas = _atlases.get(radius)
+    if atlas is None:
+        atlas = BubbleAtlas(radius)
+        _atlases[radius] = atlas
+    return atlas
+
+
+class BubbleGrid:
+    """千鳥格子に並んだプチプチの空間インデックス
+
+    並びが規則的なので、マウス座標から行・列を逆算すれば
+    触っている可能性のあるプチプチ（最大4個）がO(1)で分かる。
+    """
+
+    def __init__(self, offset_x, offset_y):
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    @staticmethod
+    def row_shift(r):
+        """奇数行は半分ずらす"""
+        return (SPACING // 2) - (SPACING // 4) if r % 2 == 1 else 0
+
+    def position(self, r, c):
+        bx = self.offset_x + c * SPACING + self.row_shift(r)
+        by = self.offset_y + r * SPACING
+        return bx, by
+
+    def get(self, r, c):
+        """(r, c) のプチプチ（並べ方はサブクラスが決める）"""
+        raise NotImplementedError
+
+    def in_rect(self, rect):
+        """rect と描画範囲が重なるプチプチ（描く順＝行・列の昇順）"""
+        margin = BUBBLE_RADIUS + 6 + SPACING
+        r0 = math.floor((rect.top - margin - self.offset_y) / SPACING)
+        r1 = math.ceil((rect.bottom + margin - self.offset_y) / SPACING)
+        c0 = math.floor((rect.left - margin - self.offset_x) / SPACING)
+        c1 = math.ceil((rect.right + margin - self.offset_x) / SPACING)
+
+        found = []
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                b = self.get(r, c)
+                if b is not None and b.bounds().colliderect(rect):
+                    found.append(b)
+        return found
+
+    def candidates(self, pos):
+        """pos の近く（上下2行 x 左右2列）にあるプチプチを返す"""
+        mx, my = pos
+        # 当たり判定の半径(radius+5)は SPACING/2 程度なので、隣のマスまで見れば十分
+        r0 = math.floor((my - self.offset_y) / SPACING)
+        found = []
+        for r in (r0, r0 + 1):
+            c0 = math.floor((mx - self.offset_x - self.row_shift(r)) / SPACING)
+            for c in (c0, c0 + 1):
+                b = self.get(r, c)
+                if b is not None:
+                    found.append(b)
+        return found
+
+
+class SheetChunk:
+    """無限シートの一区画（CHUNK_ROWS x CHUNK_COLS 個のプチプチ）
+
+    メモリにある間だけ Bubble オブジェクトを持つ。
+    捨てる時は潰れたかどうかだけをビット列（1個1bit）にして残す。
+    """
+
+    def __init__(self, sheet, cr, cc, bits=None):
+        self.cr = cr
+        self.cc = cc
+        self.bubbles = []  # [lr * CHUNK_COLS + lc] の順
+        for lr in range(CHUNK_ROWS):
+            for lc in range(CHUNK_COLS):
+                bx, by = sheet.position(cr * CHUNK_ROWS + lr, cc * CHUNK_COLS + lc)
+                self.bubbles.append(Bubble(bx, by))
+
+        if bits is not None:
+            for i, b in enumerate(self.bubbles):
+                b.is_popped = bool(bits[i >> 3] & (1 << (i & 7)))
+
+    def to_bits(self):
+        """潰れた状態をビット列にする（1つも潰れていなければ None）"""
+        bits = bytearray((CHUNK_ROWS * CHUNK_COLS + 7) // 8)
+        for i, b in enumerate(self.bubbles):
+            if b.is_popped:
+                bits[i >> 3] |= 1 << (i & 7)
+        return bytes(bits) if any(bits) else None
+
+    def is_busy(self):
+        """触られている途中（圧力が残っている）なら捨てない"""
+        return any(b.pressure > 0 for b in self.bubbles)
+
+
+class InfiniteSheet(BubbleGrid):
+    """どこまでもスクロールできるプチプチシート
+
+    チャンクは見えた時（get で触られた時）に作り、LRUで MAX_LOADED_CHUNKS を
+    超えたら古いものから捨てる。捨てたチャンクの状態はビット列だけ残すので、
+    どれだけスクロールしてもメモリは「潰したチャンクの数 x 8バイト」程度で収まる。
+    """
+
+    def __init__(self):
+        super().__init__(SPACING / 2, SPACING / 2)
+        self.loaded = OrderedDict()  # (cr, cc) -> SheetChunk（後ろほど最近使った）
+        self.saved = {}  # (cr, cc) -> bytes（潰れたプチプチがあるチャンクだけ）
+
+    def chunk(self, cr, cc):
+        key = (cr, cc)
+        chunk = self.loaded.get(key)
+        if chunk is None:
+            chunk = SheetChunk(self, cr, cc, self.saved.get(key))
+            self.loaded[key] = chunk
+            self.evict()
+        else:
+            self.loaded.move_to_end(key)
+        return chunk
+
+    def get(self, r, c):
+        cr, lr = divmod(r, CHUNK_ROWS)
+        cc, lc = divmod(c, CHUNK_COLS)
+        return self.chunk(cr, cc).bubbles[lr * CHUNK_COLS + lc]
+
+    def evict(self):
+        """古いチャンクを捨てる（状態はビット列にして保存）"""
+        for key in list(self.loaded):
+            if len(self.loaded) <= MAX_LOADED_CHUNKS:
+                break
+            chunk = self.loaded[key]
+            if chunk.is_busy():
+                continue
+
+            bits = chunk.to_bits()
+            if bits is None:
+                self.saved.pop(key, None)
+            else:
+                self.saved[key] = bits
+            del self.loaded[key]
+
+    def reset(self):
+        """全部元に戻す"""
+        self.saved.clear()
+        for chunk in self.loaded.values():
+            for b in chunk.bubbles:
+                b.is_popped = False
+                b.pressure = 0
+
+
+def update_bubbles(grid, active, mouse_pos, mouse_pressed):
+    """マウス下の候補と、圧力が残っているプチプチだけを更新する
+
+    active は「圧力か震えが残っているプチプチ」の集合（dictを順序付き集合として使う）。
+    (破裂したプチプチ, 更新したプチプチ) のリストを返す。
+    """
+    targets = dict(active)
+    if mouse_pressed:
+        for b in grid.candidates(mouse_pos):
+            targets[b] = True
+
+    popped = []
+    for b in targets:
+        if b.update(mouse_pos, mouse_pressed):
+            popped.append(b)
+
+        if b.pressure > 0 or b.shake_x or b.shake_y:
+            active[b] = True
+        else:
+            active.pop(b, None)
+
+    return popped, list(targets)
+
+
+class DirtyRenderer:
+    """変化した所だけ描き直して display.update(rects) で画面に送る
+
+    見た目（位置・圧力段階）が変わったプチプチの前後の範囲と、
+    パーティクルの前後の範囲だけを背景で塗り直し、重なるものを描き直す。
+    プチプチとパーティクルはシート上の座標で、camera だけずらして描く。
+    """
+
+    MAX_RECTS = 32  # これより多ければ1つにまとめる
+
+    def __init__(self, screen, grid, hud, hud_pos):
+        self.screen = screen
+        self.grid = grid
+        self.hud = hud
+        self.hud_rect = hud.get_rect(topleft=hud_pos)
+
+        self.camera = (0, 0)
+        self.drawn = {}  # Bubble -> 最後に描いた時の draw_state()
+        self.particle_rect = None
+        self.full_redraw = True
+
+    def invalidate(self):
+        """次のフレームで画面全体を描き直す"""
+        self.full_redraw = True
+
+    def set_camera(self, camera):
+        """スクロールしたら全体を描き直す"""
+        if camera != self.camera:
+            self.camera = camera
+            self.full_redraw = True
+
+    def view_rect(self, rect):
+        """シート上の矩形 -> 画面上の矩形"""
+        return rect.move(-self.camera[0], -self.camera[1])
+
+    def render(self, touched, particles):
+        if self.full_redraw:
+            self.render_full(particles)
+            return
+
+        rects = []  # シート上の座標
+
+        # プチプチ：見た目が変わったものの、前の位置と今の位置
+        for b in touched:
+            state = b.draw_state()
+            old = self.drawn.get(b)
+            if old != state:
+                if old is not None:
+                    half = b.radius + 6
+                    rects.append(
+                        pygame.Rect(old[0] - half, old[1] - half, half * 2, half * 2)
+                    )
+                rects.append(b.bounds())
+                self.drawn[b] = state
+
+        # パーティクル：前のフレームの範囲と今の範囲
+        p_rect = particles.bounds()
+        for r in (self.particle_rect, p_rect):
+            if r is not None:
+                rects.append(r)
+        self.particle_rect = p_rect
+
+        if not rects:
+            return
+
+        screen_rect = self.screen.get_rect()
+        rects = [self.view_rect(r).clip(screen_rect) for r in rects]
+        rects = [r for r in rects if r.width > 0 and r.height > 0]
+        if not rects:
+            return
+        if len(rects) > self.MAX_RECTS:
+            rects = [rects[0].unionall(rects[1:])]
+
+        for rect in rects:
+            self.screen.set_clip(rect)
+            self.screen.fill(BG_COLOR, rect)
+            world = rect.move(self.camera)
+            for b in self.grid.in_rect(world):
+                b.draw(self.screen, self.camera)
+            particles.draw(self.screen, self.camera)
+            if self.hud_rect.colliderect(rect):
+                self.screen.blit(self.hud, self.hud_rect)
+        self.screen.set_clip(None)
+
+        pygame.display.update(rects)
+
+    def render_full(self, particles):
+        self.screen.fill(BG_COLOR)
+
+        # 見えている範囲のプチプチだけ（描いた記録も作り直す）
+        self.drawn.clear()
+        world = self.screen.get_rect().move(self.camera)
+        for b in self.grid.in_rect(world):
+            b.draw(self.screen, self.camera)
+            self.drawn[b] = b.draw_state()
+
+        particles.draw(self.screen, self.camera)
+        self.particle_rect = particles.bounds()
+
+        self.screen.blit(self.hud, self.hud_rect)
 
-            s_hl = pygame.Surface((40, 40), pygame.SRCALPHA)
-            pygame.draw.circle(s_hl, (*COLOR_HIGHLIGHT, 180), (20, 20), hl_radius)
-            screen.blit(s_hl, (hl_pos_x - 20, hl_pos_y - 20))
+        pygame.display.flip()
+        self.full_redraw = False
 
 
 def main():
@@ -176,66 +608,61 @@ def main():
     pygame.display.set_caption("Bubble Wrap: Press and Hold to Pop")
     clock = pygame.time.Clock()
     font = pygame.font.SysFont("Arial", 20)
+    inputs = input_trace.open_input()
 
-    bubbles = []
-    # 配置計算
-    cols = int(WIDTH // SPACING)
-    rows = int(HEIGHT // SPACING)
-
-    offset_x = (WIDTH - (cols * SPACING)) / 2 + SPACING / 2
-    offset_y = (HEIGHT - (rows * SPACING)) / 2 + SPACING / 2
+    sheet = InfiniteSheet()
+    active = {}  # 圧力が残っているプチプチ
+    camera_x, camera_y = 0, 0  # シート上のどこを見ているか
 
-    for r in range(rows):
-        for c in range(cols):
-            shift = (SPACING // 2) if r % 2 == 1 else 0
-            bx = offset_x + c * SPACING + shift - (SPACING // 4 if r % 2 == 1 else 0)
-            by = offset_y + r * SPACING
+    particles = ParticlePool()
 
-            # 画面内チェック
-            if 0 < bx < WIDTH and 0 < by < HEIGHT:
-                bubbles.append(Bubble(bx, by))
-
-    particles = []
+    text = font.render(
+        "Hold Click to Squeeze / Arrows, Wheel to Scroll / R to Reset",
+        True,
+        (150, 150, 150),
+    )
+    renderer = DirtyRenderer(screen, sheet, text, (20, HEIGHT - 30))
 
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        mouse_pressed = pygame.mouse.get_pressed()[0]
+        mouse_pressed = inputs.get_pressed()[0]
 
-        for event in pygame.event.get():
+        for event in inputs.get_events():
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_r:
-                    for b in bubbles:
-                        b.is_popped = False
-                        b.pressure = 0
-
-        # 更新
-        for b in bubbles:
-            if b.update(mouse_pos, mouse_pressed):
-                # 破裂
-                for _ in range(12):
-                    particles.append(Particle(b.x, b.y))
-
-        particles = [p for p in particles if p.life > 0]
-        for p in particles:
-            p.update()
-
-        # 描画
-        screen.fill(BG_COLOR)
-
-        for b in bubbles:
-            b.draw(screen)
-
-        for p in particles:
-            p.draw(screen)
-
-        text = font.render("Hold Click to Squeeze / R to Reset", True, (150, 150, 150))
-        screen.blit(text, (20, HEIGHT - 30))
-
-        pygame.display.flip()
-        clock.tick(60)
+                    sheet.reset()
+                    active.clear()
+                    renderer.invalidate()
+            elif event.type == pygame.MOUSEWHEEL:
+                camera_x -= event.x * WHEEL_STEP
+                camera_y -= event.y * WHEEL_STEP
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                renderer.invalidate()
+
+        # スクロール
+        keys = inputs.get_keys()
+        camera_x += (keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * SCROLL_SPEED
+        camera_y += (keys[pygame.K_DOWN] - keys[pygame.K_UP]) * SCROLL_SPEED
+        renderer.set_camera((camera_x, camera_y))
+
+        # マウス位置をシート上の座標にする
+        mx, my = inputs.get_pos()
+        mouse_pos = (mx + camera_x, my + camera_y)
+
+        # 更新（触っている・圧力が残っているものだけ）
+        popped, touched = update_bubbles(sheet, active, mouse_pos, mouse_pressed)
+        for b in popped:
+            # 破裂
+            particles.emit(b.x, b.y)
+
+        particles.update()
+
+        # 描画（変化した所だけ）
+        renderer.render(touched, particles)
+
+        inputs.tick(clock, 60)
 
     pygame.quit()
 
@@ -0,0 +1,381 @@
+"""デモのマウス・キー入力を記録して、あとで同じ入力で再生する
+
+各デモは pygame.event / pygame.mouse / pygame.key を直接読む代わりに、
+open_input() が返す入力ソースから読む（何も設定しなければ今まで通り pygame から読む）。
+
+使い方:
+    python input_trace.py record magnet magnet.trace
+        # いつも通り遊んだ入力をフレームごとに記録する（ウィンドウを閉じると終わり）
+    python input_trace.py replay magnet magnet.trace
+        # 画面を開かずに（SDL の dummy ドライバ）フレームレート無制限で再生し、
+        # フレームごとの時間と最後の画面のハッシュをJSONで表示
+    python input_trace.py replay magnet magnet.trace --output result.json
+    python input_trace.py replay magnet magnet.trace --baseline result.json
+        # 最後の画面が変わった・平均が20%以上遅くなったら終了コード1
+
+トレースのファイル形式（リトルエンディアン）:
+    ヘッダ  : MAGIC, バージョン(u16), デモ名の長さ(u8), デモ名(utf-8)
+    フレーム: 経過ms(u16), マウスx(i16), マウスy(i16), ボタン(u8), イベント数(u16)
+              のあとに イベント数 x (種類(u8), コード(i32), x(i16), y(i16), 追加(u16))
+    経過ms は clock.tick の戻り値（そのフレームが何ms続いたか）で、再生ではこれを返す。
+    追加はキーの修飾 (event.mod)。KMOD_SCROLL = 0x8000 まで u16 の全ビットを使う。
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import sys
+import time
+
+import numpy as np
+import pygame
+
+DEMOS = [
+    "magnet",
+    "bubble_wrap",
+    "suction_cup",
+    "rain_drop_window",
+    "anisotropic_velvet",
+]
+SEED = 1234  # 再生（と記録）の前に random と np.random をこの値で初期化する
+
+MAGIC = b"DDLT"
+VERSION = 2  # 形式を変えたら上げる（1 は 追加 が i16 で、KMOD_SCROLL を書けなかった）
+HEADER = struct.Struct("<4sHB")
+FRAME = struct.Struct("<HhhBH")
+EVENT = struct.Struct("<BihhH")
+
+# 記録するイベントの種類（番号はファイルに書く値）
+EVENT_KINDS = {
+    pygame.QUIT: 0,
+    pygame.KEYDOWN: 1,
+    pygame.KEYUP: 2,
+    pygame.MOUSEBUTTONDOWN: 3,
+    pygame.MOUSEBUTTONUP: 4,
+    pygame.MOUSEWHEEL: 5,
+}
+EVENT_TYPES = {kind: event_type for event_type, kind in EVENT_KINDS.items()}
+
+
+def encode_event(event):
+    """pygame のイベントを EVENT の値の組にする"""
+    kind = EVENT_KINDS[event.type]
+    if event.type in (pygame.KEYDOWN, pygame.KEYUP):
+        return kind, event.key, 0, 0, event.mod
+    if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+        return kind, event.button, event.pos[0], event.pos[1], 0
+    if event.type == pygame.MOUSEWHEEL:
+        return kind, 0, event.x, event.y, 0
+    return kind, 0, 0, 0, 0
+
+
+def decode_event(kind, code, x, y, extra):
+    """encode_event の逆（デモが読む属性だけを持つイベントを作る）"""
+    event_type = EVENT_TYPES[kind]
+    if event_type in (pygame.KEYDOWN, pygame.KEYUP):
+        return pygame.event.Event(
+            event_type, key=code, mod=extra, unicode="", scancode=0
+        )
+    if event_type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+        return pygame.event.Event(event_type, button=code, pos=(x, y))
+    if event_type == pygame.MOUSEWHEEL:
+        return pygame.event.Event(event_type, x=x, y=y, flipped=False)
+    return pygame.event.Event(event_type)
+
+
+def screen_hash():
+    """今の画面（最後に描いたフレーム）の sha1"""
+    surface = pygame.display.get_surface()
+    return hashlib.sha1(pygame.image.tobytes(surface, "RGB")).hexdigest()
+
+
+class LiveInput:
+    """pygame から直接読む（今まで通りの動き）"""
+
+    def get_events(self):
+        return pygame.event.get()
+
+    def get_pos(self):
+        return pygame.mouse.get_pos()
+
+    def get_pressed(self):
+        return pygame.mouse.get_pressed()
+
+    def get_keys(self):
+        return pygame.key.get_pressed()
+
+    def tick(self, clock, fps):
+        """1フレームの終わり。clock.tick(fps) の戻り値（ms）を返す"""
+        return clock.tick(fps)
+
+    def close(self):
+        pass
+
+
+class TraceRecorder(LiveInput):
+    """pygame から読みつつ、読んだ入力をトレースファイルに書く
+
+    マウスはフレームの中で最初に読んだ値を使い回すので、
+    同じフレームで何度読んでも再生した時と同じ値になる。
+    """
+
+    def __init__(self, path, demo):
+        self.file = open(path, "wb")
+        name = demo.encode()
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(name)) + name)
+        self.frames = 0
+        self.events = []
+        self.mouse = None
+
+    def _sample(self):
+        if self.mouse is None:
+            self.mouse = (pygame.mouse.get_pos(), pygame.mouse.get_pressed())
+        return self.mouse
+
+    def get_events(self):
+        events = pygame.event.get()
+        self.events.extend(e for e in events if e.type in EVENT_KINDS)
+        return events
+
+    def get_pos(self):
+        return self._sample()[0]
+
+    def get_pressed(self):
+        return self._sample()[1]
+
+    def tick(self, clock, fps):
+        dt = clock.tick(fps)
+        (x, y), pressed = self._sample()
+        buttons = sum(1 << i for i, down in enumerate(pressed[:3]) if down)
+        self.file.write(FRAME.pack(min(dt, 0xFFFF), x, y, buttons, len(self.events)))
+        for event in self.events:
+            self.file.write(EVENT.pack(*encode_event(event)))
+        self.frames += 1
+        self.events = []
+        self.mouse = None
+        return dt
+
+    def close(self):
+        self.file.close()
+
+
+class KeyState:
+    """pygame.key.get_pressed() の代わり（keys[pygame.K_LEFT] のように読む）"""
+
+    def __init__(self, pressed):
+        self.pressed = pressed
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+
+class TraceReplayer:
+    """トレースファイルの入力を1フレームずつ返す（待たずにすぐ次のフレームへ進む）
+
+    tick() の間隔（デモが1フレームにかかった時間）を frame_ms に貯め、
+    最後のフレームを描き終わったら state_hash に画面のハッシュを入れる。
+    トレースを使い切った後は QUIT イベントを返してデモを終わらせる。
+    """
+
+    def __init__(self, path, demo=None):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, name_len = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"not an input trace: {path}")
+        if version != VERSION:
+            raise ValueError(
+                f"unsupported trace version {version} (expected {VERSION}): {path}"
+            )
+        offset = HEADER.size
+        self.demo = data[offset : offset + name_len].decode()
+        offset += name_len
+        if demo is not None and demo != self.demo:
+            raise ValueError(f"trace was recorded with {self.demo}, not {demo}")
+
+        # (経過ms, マウス位置, ボタン, イベントの値の組のリスト)
+        self.frames = []
+        while offset < len(data):
+            dt, x, y, buttons, count = FRAME.unpack_from(data, offset)
+            offset += FRAME.size
+            events = [
+                EVENT.unpack_from(data, offset + i * EVENT.size) for i in range(count)
+            ]
+            offset += count * EVENT.size
+            pressed = tuple(bool(buttons >> i & 1) for i in range(3))
+            self.frames.append((dt, (x, y), pressed, events))
+
+        self.index = 0
+        self.keys = set()
+        self.last_mouse = ((0, 0), (False, False, False))
+        self.frame_ms = []
+        self.frame_start = None
+        self.state_hash = None
+
+    def _frame(self):
+        if self.frame_start is None:
+            self.frame_start = time.perf_counter()
+        if self.index < len(self.frames):
+            return self.frames[self.index]
+        return None
+
+    def get_events(self):
+        frame = self._frame()
+        if frame is None:
+            return [pygame.event.Event(pygame.QUIT)]
+        events = [decode_event(*values) for values in frame[3]]
+        for event in events:
+            if event.type == pygame.KEYDOWN:
+                self.keys.add(event.key)
+            elif event.type == pygame.KEYUP:
+                self.keys.discard(event.key)
+        return events
+
+    def get_pos(self):
+        frame = self._frame()
+        return frame[1] if frame else self.last_mouse[0]
+
+    def get_pressed(self):
+        frame = self._frame()
+        return frame[2] if frame else self.last_mouse[1]
+
+    def get_keys(self):
+        return KeyState(self.keys)
+
+    def tick(self, clock, fps):
+        frame = self._frame()
+        self.frame_ms.append((time.perf_counter() - self.frame_start) * 1000.0)
+        self.frame_start = None
+        if frame is None:
+            return 1000 // fps
+
+        self.last_mouse = (frame[1], frame[2])
+        self.index += 1
+        if self.index == len(self.frames):
+            self.state_hash = screen_hash()
+        return frame[0]
+
+    def close(self):
+        pass
+
+
+_source = None
+
+
+def use(source):
+    """以降 open_input() が返す入力ソースを差し替える（None で pygame に戻す）"""
+    global _source
+    _source = source
+
+
+def open_input():
+    """デモの main() が最初に呼ぶ。use() されていなければ LiveInput"""
+    return _source if _source is not None else LiveInput()
+
+
+def run_demo(demo, source, seed=SEED):
+    """source から入力を読ませて demo（モジュール名）の main() を最後まで動かす"""
+    module = importlib.import_module(demo)
+    random.seed(seed)
+    np.random.seed(seed)
+    use(source)
+    try:
+        module.main()
+    finally:
+        use(None)
+        source.close()
+
+
+def summarize(demo, trace, replayer):
+    """再生結果のdict（frame_ms はフレームごとの時間）"""
+    frame_ms = replayer.frame_ms[: len(replayer.frames)]
+    total = sum(frame_ms) / 1000.0
+    ordered = sorted(frame_ms)
+    return {
+        "demo": demo,
+        "trace": trace,
+        "frames": len(frame_ms),
+        "seconds": total,
+        "frames_per_second": len(frame_ms) / total if total else 0.0,
+        "ms_mean": statistics.fmean(frame_ms) if frame_ms else 0.0,
+        "ms_median": statistics.median(frame_ms) if frame_ms else 0.0,
+        "ms_p95": ordered[int(len(ordered) * 0.95)] if ordered else 0.0,
+        "ms_max": ordered[-1] if ordered else 0.0,
+        "state_hash": replayer.state_hash,
+        "frame_ms": frame_ms,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="record / replay demo input")
+    parser.add_argument("command", choices=["record", "replay"])
+    parser.add_argument("demo", choices=DEMOS)
+    parser.add_argument("trace", help="トレースファイルのパス")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", help="再生結果のJSONを保存するパス")
+    parser.add_argument("--baseline", help="比較する過去の再生結果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        recorder = TraceRecorder(args.trace, args.demo)
+        run_demo(args.demo, recorder, args.seed)
+        print(f"{recorder.frames} frames recorded to {args.trace}", file=sys.stderr)
+        return 0
+
+    # 画面も音も出さない（pygame.init() より前に決めておく）
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    replayer = TraceReplayer(args.trace, args.demo)
+    run_demo(args.demo, replayer, args.seed)
+
+    result = summarize(args.demo, args.trace, replayer)
+    print(
+        f"{args.demo:>18}: {result['frames']} frames "
+        f"{result['ms_mean']:8.3f} ms/frame (p95 {result['ms_p95']:.3f}) "
+        f"hash {result['state_hash']}",
+        file=sys.stderr,
+    )
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "result": result,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            prev = json.load(f)["result"]
+        status = 0
+        if prev["state_hash"] != result["state_hash"]:
+            print("State mismatch: the final frame differs", file=sys.stderr)
+            status = 1
+        if result["ms_mean"] > prev["ms_mean"] * (1.0 + args.tolerance):
+            print(
+                f"Regression: {prev['ms_mean']:.3f} -> {result['ms_mean']:.3f} ms",
+                file=sys.stderr,
+            )
+            status = 1
+        return status
+    return 0
+
+
+if __name__ == "__main__":
+    # デモは "input_trace" として import するので、use() の設定がデモから
+    # 見えるように __main__ ではなく同じ名前のモジュールの main() を呼ぶ
+    import input_trace
+
+    sys.exit(input_trace.main())
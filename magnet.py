@@ -1,5 +1,8 @@
 import pygame
 import math
+import numpy as np
+
+import input_trace
 
 # --- 設定パラメータ ---
 WIDTH, HEIGHT = 800, 600
@@ -15,7 +18,30 @@ BORDER_COLOR = (150, 150, 150)
 MAGNET_FORCE = 2500.0  # 磁力
 MAX_FORCE = 15.0  # 力の上限
 FRICTION = 0.70  # 摩擦（止まりやすくする）
-SUB_STEPS = 10  # 計算精度
+STOP_SPEED = 0.05  # これより遅い速度は0にする（基準サブステップでの値）
+SUB_STEPS = 10  # 計算精度（基準のサブステップ数。物理パラメータはこの刻みで調整済み）
+
+# 時間刻み（描画とは独立した固定タイムステップ）
+RENDER_FPS = 60  # 描画の上限
+PHYSICS_HZ = 60  # 物理の更新回数/秒
+FIXED_DT = 1.0 / PHYSICS_HZ
+MAX_TICKS_PER_FRAME = 5  # 遅いマシンで処理が追いつかない時の上限
+MIN_SUB_STEPS = 2  # 落ち着いている時
+MAX_SUB_STEPS = 20  # 吸着の瞬間など速い時
+MAX_STEP_TRAVEL = 2.0  # 1サブステップで磁石同士が近づいてよい距離(px)
+APPROACH_RANGE = 80.0  # この隙間以内で動いているペアは基準(SUB_STEPS)以上で刻む
+
+# ソルバー設定
+USE_NUMPY_SOLVER = True  # 磁力計算をNumPyでまとめて行う
+POLE_CHUNK = 1024  # 一度に計算する極の数（メモリ使用量の上限）
+BROAD_PHASE_CELL = 160  # 衝突判定グリッドのセルサイズ（磁石の長辺より大きく）
+MAGNET_MIN_FORCE = 0.0  # これより弱い極ペアの力は無視する（0で無効）
+
+# スリープ設定（止まった磁石は計算しない）
+SLEEP_EPSILON = 0.01  # これ以下の移動量・速度なら「静止」とみなす
+SLEEP_STEPS = 30  # 静止がこのサブステップ数続いたら眠る
+CONTACT_MARGIN = 1.0  # この隙間以内なら「接触している」（同じ島になる）
+WAKE_MARGIN = 60.0  # 動いている磁石がこの距離まで近づいたら起こす（ぶつかられる前に）
 
 
 class Pole:
@@ -72,11 +98,36 @@ class BarMagnet:
         self.is_dragging = False
         self.drag_mode = 0  # 1=Left, 3=Right
 
+        # スリープ状態
+        self.is_sleeping = False
+        self.rest_steps = 0  # 静止が続いているサブステップ数
+        self.prev_x = x
+        self.prev_y = y
+
+        # 前回の物理tick終了時の位置（接近速度の計測用）
+        self.tick_x = x
+        self.tick_y = y
+
     def rotate(self, direction):
         """90度回転させる (direction: 1=Right, -1=Left)"""
         self.angle += direction * 90
         self.angle %= 360
         self.update_geometry()
+        self.wake()
+
+    def wake(self):
+        """スリープ解除（rest_steps=0 の間は周りの磁石も起こす）"""
+        self.is_sleeping = False
+        self.rest_steps = 0
+
+    def wake_if_pulled(self, fx, fy):
+        """眠っている時に受けた力 (fx, fy) で、起きていれば動き出すなら起こす
+
+        update_physics の停止判定と同じ基準（止まっている磁石に力を1回与えて
+        摩擦をかけた速度が stop_speed 以上か）。刻み幅 h は両辺で打ち消し合う。
+        """
+        if max(abs(fx), abs(fy)) / self.mass * FRICTION >= STOP_SPEED:
+            self.wake()
 
     def update_geometry(self):
         """角度に基づいて幅/高さと極の位置を更新"""
@@ -90,30 +141,44 @@ class BarMagnet:
         for p in self.poles:
             p.update_pos(self.width, self.height, self.angle)
 
+    def is_pinned(self):
+        """力や衝突で動かされない状態（ドラッグ中・スリープ中）"""
+        return self.is_dragging or self.is_sleeping
+
     def apply_force(self, fx, fy):
-        if not self.is_dragging:
+        if not self.is_pinned():
             self.vx += fx / self.mass
             self.vy += fy / self.mass
 
-    def update_physics(self):
+    def update_physics(self, h=1.0, bounds=(WIDTH, HEIGHT)):
+        """h は基準サブステップ何個分進めるか（サブステップ数が少ない時は h > 1）
+
+        bounds は盤面の (幅, 高さ)。磁石はこの中に閉じ込められる。
+        """
+        if self.is_sleeping:
+            return
+
         if self.is_dragging:
             self.vx = 0
             self.vy = 0
             return
 
-        self.vx *= FRICTION
-        self.vy *= FRICTION
+        self.vx *= FRICTION**h
+        self.vy *= FRICTION**h
 
-        if abs(self.vx) < 0.05:
+        # 止まる速度も刻み幅に合わせる（h=1 の時と同じ力で止まるように）
+        stop_speed = STOP_SPEED * h * FRICTION ** (h - 1)
+        if abs(self.vx) < stop_speed:
             self.vx = 0
-        if abs(self.vy) < 0.05:
+        if abs(self.vy) < stop_speed:
             self.vy = 0
 
-        self.x += self.vx
-        self.y += self.vy
+        self.x += self.vx * h
+        self.y += self.vy * h
 
-        self.x = max(self.width / 2, min(WIDTH - self.width / 2, self.x))
-        self.y = max(self.height / 2, min(HEIGHT - self.height / 2, self.y))
+        board_w, board_h = bounds
+        self.x = max(self.width / 2, min(board_w - self.width / 2, self.x))
+        self.y = max(self.height / 2, min(board_h - self.height / 2, self.y))
 
     def get_rect(self):
         return pygame.Rect(
@@ -122,12 +187,28 @@ class BarMagnet:
 
     def draw(self, screen, font):
         rect = self.get_rect()
+        screen.blit(self.get_sprite(font), rect.topleft)
+
+    def get_sprite(self, font):
+        """描画済みの画像をキャッシュから取り出す（無ければ一度だけ描く）"""
+        highlight = self.is_dragging and self.drag_mode == 3
+        key = (self.width, self.height, self.angle, highlight, font)
+        sprite = _sprite_cache.get(key)
+        if sprite is None:
+            sprite = self.render_sprite(font, highlight)
+            _sprite_cache[key] = sprite
+        return sprite
+
+    def render_sprite(self, font, highlight):
+        """磁石1本分の画像を作る（サイズ・角度・強調枠ごとに1回だけ呼ばれる）"""
+        w, h = int(self.width), int(self.height)
+        surf = pygame.Surface((w, h))
+        rect = surf.get_rect()
 
         # 角度に応じて描画色を塗り分ける
         # N極エリアとS極エリアを計算
 
         cx, cy = rect.centerx, rect.centery
-        w, h = rect.width, rect.height
 
         rect_n = None
         rect_s = None
@@ -145,19 +226,19 @@ class BarMagnet:
             rect_n = pygame.Rect(rect.x, rect.y, w, h / 2)
             rect_s = pygame.Rect(rect.x, rect.y + h / 2, w, h / 2)
 
-        pygame.draw.rect(screen, COLOR_S, rect_s)
-        pygame.draw.rect(screen, COLOR_N, rect_n)
+        pygame.draw.rect(surf, COLOR_S, rect_s)
+        pygame.draw.rect(surf, COLOR_N, rect_n)
 
         # 枠線
-        pygame.draw.rect(screen, BORDER_COLOR, rect, width=1)
+        pygame.draw.rect(surf, BORDER_COLOR, rect, width=1)
 
         # 強制モード枠
-        if self.is_dragging and self.drag_mode == 3:
-            pygame.draw.rect(screen, (255, 200, 0), rect, width=3)
+        if highlight:
+            pygame.draw.rect(surf, (255, 200, 0), rect, width=3)
 
         # 文字（回転に合わせて描画位置調整）
-        s_surf = font.render("S", True, TEXT_COLOR)
-        n_surf = font.render("N", True, TEXT_COLOR)
+        s_surf = render_text(font, "S", TEXT_COLOR)
+        n_surf = render_text(font, "N", TEXT_COLOR)
 
         # 中心から少しずらして配置
         # ポール情報を使えば正確
@@ -165,114 +246,550 @@ class BarMagnet:
             txt = n_surf if p.polarity == 1 else s_surf
             tx = cx + p.rel_x * 0.8  # 少し中心寄り
             ty = cy + p.rel_y * 0.8
-            screen.blit(txt, (tx - txt.get_width() / 2, ty - txt.get_height() / 2))
+            surf.blit(txt, (tx - txt.get_width() / 2, ty - txt.get_height() / 2))
+
+        return surf
+
+
+# --- 描画キャッシュ ---
+# font.render は重いので、同じ見た目の画像は一度だけ作って使い回す
+_sprite_cache = {}  # (width, height, angle, highlight, font) -> Surface
+_text_cache = {}  # (font, text, color) -> Surface
+
+
+def render_text(font, text, color):
+    """font.render のキャッシュ版（文字列が変わった時だけ描き直す）"""
+    key = (font, text, color)
+    surf = _text_cache.get(key)
+    if surf is None:
+        surf = font.render(text, True, color)
+        _text_cache[key] = surf
+    return surf
 
 
 # --- 物理エンジン ---
 
 
-def solve_magnetism(magnets):
-    for i in range(len(magnets)):
+def find_candidate_pairs(magnets, margin=0.0, cell_size=None):
+    """ブロードフェーズ：一様グリッドで「近くにいるかもしれない」ペアを探す
+
+    get_rect()（回転後の width/height）を margin だけ広げた矩形を
+    グリッドのセルに登録し、同じセルに入ったものだけをペア候補にする。
+    戻り値は元のループと同じ順番（i < j の昇順）の (i, j) リスト。
+    """
+    if cell_size is None:
+        cell_size = BROAD_PHASE_CELL + margin * 2
+
+    # Rectは整数に切り捨てられるので1px余分に広げる
+    pad = int(math.ceil(margin)) + 1
+
+    grid = {}
+    for idx, mag in enumerate(magnets):
+        rect = mag.get_rect().inflate(pad * 2, pad * 2)
+
+        x0 = int(rect.left // cell_size)
+        x1 = int(rect.right // cell_size)
+        y0 = int(rect.top // cell_size)
+        y1 = int(rect.bottom // cell_size)
+        for gx in range(x0, x1 + 1):
+            for gy in range(y0, y1 + 1):
+                grid.setdefault((gx, gy), []).append(idx)
+
+    pairs = set()
+    for cell in grid.values():
+        for a in range(len(cell)):
+            for b in range(a + 1, len(cell)):
+                pairs.add((cell[a], cell[b]))  # idxは昇順に登録されている
+
+    return sorted(pairs)
+
+
+def _magnet_pairs(magnets, min_force):
+    """磁力計算の対象ペア（カットオフ無しなら全ペア）"""
+    if min_force <= 0:
+        n = len(magnets)
+        return [(i, j) for i in range(n) for j in range(i + 1, n)]
+
+    # 力が min_force になる距離より遠い極ペアは計算しない
+    cutoff = math.sqrt(MAGNET_FORCE / min_force)
+    return find_candidate_pairs(magnets, margin=cutoff / 2)
+
+
+def solve_magnetism(magnets, min_force=0.0, h=1.0):
+    """min_force > 0 のとき、逆二乗の力がそれ未満の極ペアは無視する
+
+    h は基準サブステップ何個分の力積を与えるか。
+    眠っている磁石は動かさず、起きている磁石から受ける力だけを集めて
+    動き出す強さなら起こす（眠っている島の内部の力は釣り合っている）。
+    """
+    pull = {}  # 眠っている磁石の番号 -> 起きている磁石から受ける力 [fx, fy]
+    for i, j in _magnet_pairs(magnets, min_force):
         mag1 = magnets[i]
-        for j in range(i + 1, len(magnets)):
-            mag2 = magnets[j]
-
-            # 右クリック無視
-            if (mag1.is_dragging and mag1.drag_mode == 3) or (
-                mag2.is_dragging and mag2.drag_mode == 3
-            ):
-                continue
-
-            for p1 in mag1.poles:
-                p1_pos = p1.get_world_pos(mag1.x, mag1.y)
-                for p2 in mag2.poles:
-                    p2_pos = p2.get_world_pos(mag2.x, mag2.y)
-
-                    dx = p2_pos[0] - p1_pos[0]
-                    dy = p2_pos[1] - p1_pos[1]
-                    dist_sq = dx * dx + dy * dy
-                    if dist_sq < 4.0:
-                        dist_sq = 4.0  # ガード
-                    dist = math.sqrt(dist_sq)
-
-                    force = MAGNET_FORCE / dist_sq
-                    force = min(force, MAX_FORCE)
-
-                    if p1.polarity == p2.polarity:
-                        force *= -1.0  # 同極反発
-
-                    fx = (dx / dist) * force
-                    fy = (dy / dist) * force
-
-                    mag1.apply_force(fx, fy)
-                    mag2.apply_force(-fx, -fy)
-
-
-def solve_collisions(magnets):
-    """矩形衝突判定（回転後もAABBとして処理可能）"""
-    for i in range(len(magnets)):
-        for j in range(i + 1, len(magnets)):
-            m1 = magnets[i]
-            m2 = magnets[j]
-
-            dx = m2.x - m1.x
-            dy = m2.y - m1.y
-
-            # 現在のサイズ（回転適用済み）で判定
-            min_dist_x = (m1.width + m2.width) / 2
-            min_dist_y = (m1.height + m2.height) / 2
-
-            overlap_x = min_dist_x - abs(dx)
-            overlap_y = min_dist_y - abs(dy)
-
-            if overlap_x > 0 and overlap_y > 0:
-                nx, ny = 0, 0
-                if overlap_x < overlap_y:
-                    nx = -1 if dx < 0 else 1
-                    overlap = overlap_x
-                else:
-                    ny = -1 if dy < 0 else 1
-                    overlap = overlap_y
-
-                total_mass = m1.mass + m2.mass
-                r1 = m2.mass / total_mass
-                r2 = m1.mass / total_mass
-
-                # 位置補正（隙間ゼロ）
-                epsilon = 0.001
-                if not m1.is_dragging:
-                    m1.x -= nx * (overlap * r1 + epsilon)
-                    m1.y -= ny * (overlap * r2 + epsilon)
-                if not m2.is_dragging:
-                    m2.x += nx * (overlap * r1 + epsilon)
-                    m2.y += ny * (overlap * r2 + epsilon)
-
-                # 速度抹殺（プルプル防止）
-                rvx = m2.vx - m1.vx
-                rvy = m2.vy - m1.vy
-                vel_normal = rvx * nx + rvy * ny
-
-                if vel_normal < 0:
-                    impulse = -vel_normal / (1 / m1.mass + 1 / m2.mass)
-                    ix, iy = impulse * nx, impulse * ny
-
-                    if not m1.is_dragging:
-                        m1.vx -= ix / m1.mass
-                        m1.vy -= iy / m1.mass
-                    if not m2.is_dragging:
-                        m2.vx += ix / m2.mass
-                        m2.vy += iy / m2.mass
-
-                    # 摩擦（横滑り防止）
-                    tx, ty = -ny, nx
-                    vt = rvx * tx + rvy * ty
-                    f_imp = -vt * 0.2
-                    if not m1.is_dragging:
-                        m1.vx -= f_imp * tx / m1.mass
-                        m1.vy -= f_imp * ty / m1.mass
-                    if not m2.is_dragging:
-                        m2.vx += f_imp * tx / m2.mass
-                        m2.vy += f_imp * ty / m2.mass
+        mag2 = magnets[j]
+
+        # 右クリック無視
+        if (mag1.is_dragging and mag1.drag_mode == 3) or (
+            mag2.is_dragging and mag2.drag_mode == 3
+        ):
+            continue
+
+        # どちらも眠っている・どちらもドラッグ中なら計算不要
+        if mag1.is_sleeping and mag2.is_sleeping:
+            continue
+        if (
+            mag1.is_pinned()
+            and mag2.is_pinned()
+            and not (mag1.is_sleeping or mag2.is_sleeping)
+        ):
+            continue
+
+        for p1 in mag1.poles:
+            p1_pos = p1.get_world_pos(mag1.x, mag1.y)
+            for p2 in mag2.poles:
+                p2_pos = p2.get_world_pos(mag2.x, mag2.y)
+
+                dx = p2_pos[0] - p1_pos[0]
+                dy = p2_pos[1] - p1_pos[1]
+                dist_sq = dx * dx + dy * dy
+                if dist_sq < 4.0:
+                    dist_sq = 4.0  # ガード
+                dist = math.sqrt(dist_sq)
+
+                force = MAGNET_FORCE / dist_sq
+                if force < min_force:
+                    continue  # 遠すぎる（カットオフ）
+                force = min(force, MAX_FORCE)
+
+                if p1.polarity == p2.polarity:
+                    force *= -1.0  # 同極反発
+
+                fx = (dx / dist) * force * h
+                fy = (dy / dist) * force * h
+
+                mag1.apply_force(fx, fy)
+                mag2.apply_force(-fx, -fy)
+
+                for k, mag, sign in ((i, mag1, 1.0), (j, mag2, -1.0)):
+                    if mag.is_sleeping:
+                        acc = pull.setdefault(k, [0.0, 0.0])
+                        acc[0] += sign * fx / h
+                        acc[1] += sign * fy / h
+
+    for k, (fx, fy) in pull.items():
+        magnets[k].wake_if_pulled(fx, fy)
+
+
+def solve_magnetism_np(magnets, min_force=0.0, h=1.0):
+    """solve_magnetism のNumPy版（全ての極ペアを一括で計算する）
+
+    極の位置・極性・持ち主を連続した配列に詰めて、逆二乗の力を
+    行列でまとめて計算する。結果は solve_magnetism と（浮動小数の誤差を除いて）同じ。
+    min_force > 0 のときはブロードフェーズで近いペアだけを配列にして計算する。
+    眠っている磁石は起きている磁石から受ける力だけを計算し、動き出す強さなら起こす。
+    """
+    # 右クリック中の磁石は計算から外す（相手側にも力が働かない）
+    active = [m for m in magnets if not (m.is_dragging and m.drag_mode == 3)]
+    n = len(active)
+    if n < 2:
+        return
+
+    # 磁石ごとの配列
+    cx = np.fromiter((m.x for m in active), np.float64, n)
+    cy = np.fromiter((m.y for m in active), np.float64, n)
+    vx = np.fromiter((m.vx for m in active), np.float64, n)
+    vy = np.fromiter((m.vy for m in active), np.float64, n)
+    mass = np.fromiter((m.mass for m in active), np.float64, n)
+    movable = np.fromiter((not m.is_pinned() for m in active), np.bool_, n)
+    sleeping = np.fromiter((m.is_sleeping for m in active), np.bool_, n)
+    if not movable.any() and not sleeping.any():
+        return
+
+    # 極ごとの配列（磁石1つにつき2極、[S, N] の順で並ぶ）
+    rel_x = np.fromiter((p.rel_x for m in active for p in m.poles), np.float64, n * 2)
+    rel_y = np.fromiter((p.rel_y for m in active for p in m.poles), np.float64, n * 2)
+    pol = np.fromiter((p.polarity for m in active for p in m.poles), np.float64, n * 2)
+
+    px = np.repeat(cx, 2) + rel_x
+    py = np.repeat(cy, 2) + rel_y
+
+    if min_force > 0:
+        # 片方でも起きているペアだけ計算する（眠っている同士は釣り合っている）
+        pairs = [
+            (i, j)
+            for i, j in _magnet_pairs(active, min_force)
+            if not (sleeping[i] and sleeping[j])
+        ]
+        fx, fy = _pole_forces_pairs(px, py, pol, pairs, min_force)
+    else:
+        # 動ける磁石の極（行）は全ての極から、眠っている磁石の極は起きている極からの力
+        fx, fy = _pole_forces_dense(px, py, pol, _pole_rows(movable))
+        if sleeping.any():
+            cols = _pole_rows(~sleeping)
+            sfx, sfy = _pole_forces_dense(px, py, pol, _pole_rows(sleeping), cols)
+            fx += sfx
+            fy += sfy
+
+    # 極の力を磁石ごとに合計して速度に反映
+    fx = fx.reshape(n, 2).sum(axis=1)
+    fy = fy.reshape(n, 2).sum(axis=1)
+    vx = np.where(movable, vx + fx / mass * h, vx)
+    vy = np.where(movable, vy + fy / mass * h, vy)
+
+    for m, new_vx, new_vy in zip(active, vx.tolist(), vy.tolist()):
+        m.vx = new_vx
+        m.vy = new_vy
+
+    # 眠っている磁石：update_physics の停止判定を超える力なら起こす
+    pulled = sleeping & (np.maximum(abs(fx), abs(fy)) / mass * FRICTION >= STOP_SPEED)
+    for k in np.flatnonzero(pulled).tolist():
+        active[k].wake()
+
+
+def _pole_rows(mask):
+    """磁石ごとの mask から、その磁石の極（[S, N] の2つずつ）の番号を作る"""
+    return np.repeat(np.flatnonzero(mask) * 2, 2) + np.tile([0, 1], int(mask.sum()))
+
+
+def _pole_forces_dense(px, py, pol, rows, cols=None):
+    """rows の極が他の全ての極（cols を渡せばその極だけ）から受ける力を行列で計算し、
+    極ごとの合力を返す"""
+    n_poles = len(px)
+    owner = np.arange(n_poles) // 2
+    if cols is not None:
+        src_x, src_y, src_pol, src_owner = px[cols], py[cols], pol[cols], owner[cols]
+    else:
+        src_x, src_y, src_pol, src_owner = px, py, pol, owner
+
+    fx = np.zeros(n_poles)
+    fy = np.zeros(n_poles)
+
+    # 極の数が多いと行列が巨大になるので、行をチャンクに分けて計算する
+    for start in range(0, len(rows), POLE_CHUNK):
+        r = rows[start : start + POLE_CHUNK]
+
+        dx = src_x[np.newaxis, :] - px[r, np.newaxis]
+        dy = src_y[np.newaxis, :] - py[r, np.newaxis]
+        dist_sq = dx * dx + dy * dy
+        np.maximum(dist_sq, 4.0, out=dist_sq)  # ガード
+
+        force = np.minimum(MAGNET_FORCE / dist_sq, MAX_FORCE)
+        # 同極(積=1)は反発、異極(積=-1)は引力
+        force *= -(pol[r, np.newaxis] * src_pol[np.newaxis, :])
+        force /= np.sqrt(dist_sq)
+
+        # 自分自身の極同士は無視
+        force[owner[r, np.newaxis] == src_owner[np.newaxis, :]] = 0.0
+
+        fx[r] = (force * dx).sum(axis=1)
+        fy[r] = (force * dy).sum(axis=1)
+
+    return fx, fy
+
+
+def _pole_forces_pairs(px, py, pol, pairs, min_force):
+    """候補ペアの極同士（1ペアにつき2x2=4組）だけ力を計算する"""
+    n_poles = len(px)
+    if not pairs:
+        return np.zeros(n_poles), np.zeros(n_poles)
+
+    pairs = np.asarray(pairs, dtype=np.intp)
+    # (S,S), (S,N), (N,S), (N,N) の4組に展開
+    pa = (pairs[:, 0:1] * 2 + np.array([0, 0, 1, 1])).ravel()
+    pb = (pairs[:, 1:2] * 2 + np.array([0, 1, 0, 1])).ravel()
+
+    dx = px[pb] - px[pa]
+    dy = py[pb] - py[pa]
+    dist_sq = dx * dx + dy * dy
+    np.maximum(dist_sq, 4.0, out=dist_sq)  # ガード
+
+    force = MAGNET_FORCE / dist_sq
+    force[force < min_force] = 0.0  # カットオフ
+    np.minimum(force, MAX_FORCE, out=force)
+    force *= -(pol[pa] * pol[pb])
+    force /= np.sqrt(dist_sq)
+
+    # 作用・反作用で両方の極に足し込む
+    fx = np.bincount(pa, force * dx, n_poles) - np.bincount(pb, force * dx, n_poles)
+    fy = np.bincount(pa, force * dy, n_poles) - np.bincount(pb, force * dy, n_poles)
+    return fx, fy
+
+
+def solve_collisions(magnets, pairs=None):
+    """矩形衝突判定（回転後もAABBとして処理可能）
+
+    ブロードフェーズで重なりそうなペアを絞ってから、
+    候補ペアだけ resolve_collision で押し戻す。
+    pairs を渡せばそれを候補に使う（重なっていないペアは何もしない）。
+    """
+    if pairs is None:
+        pairs = find_candidate_pairs(magnets)
+    for i, j in pairs:
+        m1 = magnets[i]
+        m2 = magnets[j]
+        if m1.is_sleeping and m2.is_sleeping:
+            continue  # 眠っている島の内部は解決済み
+        resolve_collision(m1, m2)
+
+
+def resolve_collision(m1, m2):
+    """ナローフェーズ：2つの磁石の重なりを解消する"""
+    dx = m2.x - m1.x
+    dy = m2.y - m1.y
+
+    # 現在のサイズ（回転適用済み）で判定
+    min_dist_x = (m1.width + m2.width) / 2
+    min_dist_y = (m1.height + m2.height) / 2
+
+    overlap_x = min_dist_x - abs(dx)
+    overlap_y = min_dist_y - abs(dy)
+
+    if overlap_x > 0 and overlap_y > 0:
+        nx, ny = 0, 0
+        if overlap_x < overlap_y:
+            nx = -1 if dx < 0 else 1
+            overlap = overlap_x
+        else:
+            ny = -1 if dy < 0 else 1
+            overlap = overlap_y
+
+        total_mass = m1.mass + m2.mass
+        r1 = m2.mass / total_mass
+        r2 = m1.mass / total_mass
+
+        # 位置補正（隙間ゼロ）
+        epsilon = 0.001
+        if not m1.is_pinned():
+            m1.x -= nx * (overlap * r1 + epsilon)
+            m1.y -= ny * (overlap * r2 + epsilon)
+        if not m2.is_pinned():
+            m2.x += nx * (overlap * r1 + epsilon)
+            m2.y += ny * (overlap * r2 + epsilon)
+
+        # 速度抹殺（プルプル防止）
+        rvx = m2.vx - m1.vx
+        rvy = m2.vy - m1.vy
+        vel_normal = rvx * nx + rvy * ny
+
+        if vel_normal < 0:
+            impulse = -vel_normal / (1 / m1.mass + 1 / m2.mass)
+            ix, iy = impulse * nx, impulse * ny
+
+            if not m1.is_pinned():
+                m1.vx -= ix / m1.mass
+                m1.vy -= iy / m1.mass
+            if not m2.is_pinned():
+                m2.vx += ix / m2.mass
+                m2.vy += iy / m2.mass
+
+            # 摩擦（横滑り防止）
+            tx, ty = -ny, nx
+            vt = rvx * tx + rvy * ty
+            f_imp = -vt * 0.2
+            if not m1.is_pinned():
+                m1.vx -= f_imp * tx / m1.mass
+                m1.vy -= f_imp * ty / m1.mass
+            if not m2.is_pinned():
+                m2.vx += f_imp * tx / m2.mass
+                m2.vy += f_imp * ty / m2.mass
+
+
+def _gap(m1, m2):
+    """2つの磁石の矩形の隙間（重なっていればマイナス）"""
+    gap_x = abs(m2.x - m1.x) - (m1.width + m2.width) / 2
+    gap_y = abs(m2.y - m1.y) - (m1.height + m2.height) / 2
+    return max(gap_x, gap_y)
+
+
+def update_sleep(magnets, pairs=None):
+    """スリープ/島の管理（サブステップの最後に呼ぶ）
+
+    静止（移動量と速度がほぼゼロ＝合力もほぼゼロ）が SLEEP_STEPS 続いた磁石は
+    眠る候補になる。接触している磁石同士は「島」としてまとめて眠り、まとめて起きる。
+    動いている・ドラッグ中・回転直後の磁石が近づくと、眠っている島は起きる。
+    （離れた磁石からの引力で起きるのは solve_magnetism 側で判定する）
+    pairs は WAKE_MARGIN / 2 以上広げた find_candidate_pairs の結果（省略時は作る）。
+    """
+    # 1. 静止カウント（動いた・ドラッグ中・起きた直後の磁石は周りを起こす）
+    n = len(magnets)
+    disturbing = [False] * n
+    for i, m in enumerate(magnets):
+        if m.is_sleeping:
+            continue
+        moved = abs(m.x - m.prev_x) + abs(m.y - m.prev_y)
+        speed = abs(m.vx) + abs(m.vy)
+        if m.is_dragging or moved > SLEEP_EPSILON or speed > SLEEP_EPSILON:
+            disturbing[i] = True
+            m.rest_steps = 0
+        else:
+            disturbing[i] = m.rest_steps == 0
+            m.rest_steps += 1
+
+    # 2. 接触グラフ（と、起こす範囲の近傍ペア）
+    contacts = [[] for _ in range(n)]
+    near = []
+    if pairs is None:
+        pairs = find_candidate_pairs(magnets, margin=WAKE_MARGIN / 2)
+    for i, j in pairs:
+        gap = _gap(magnets[i], magnets[j])
+        if gap <= CONTACT_MARGIN:
+            contacts[i].append(j)
+            contacts[j].append(i)
+        if gap <= WAKE_MARGIN:
+            near.append((i, j))
+
+    def island_of(start):
+        seen = {start}
+        stack = [start]
+        while stack:
+            k = stack.pop()
+            for other in contacts[k]:
+                if other not in seen:
+                    seen.add(other)
+                    stack.append(other)
+        return seen
+
+    # 3. 起こす：動いている磁石の近くで眠っている島
+    for i, j in near:
+        for a, b in ((i, j), (j, i)):
+            if disturbing[a] and magnets[b].is_sleeping:
+                for k in island_of(b):
+                    magnets[k].wake()
+
+    # 4. 眠らせる：島の全員が十分に静止していたら
+    visited = set()
+    for i in range(n):
+        if i in visited or magnets[i].is_sleeping:
+            continue
+        island = island_of(i)
+        visited |= island
+        if all(
+            magnets[k].is_sleeping
+            or (not magnets[k].is_dragging and magnets[k].rest_steps >= SLEEP_STEPS)
+            for k in island
+        ):
+            for k in island:
+                magnets[k].is_sleeping = True
+                magnets[k].vx = 0
+                magnets[k].vy = 0
+
+
+def step_physics(magnets, h=1.0, bounds=(WIDTH, HEIGHT)):
+    """物理を1サブステップ進める（全員眠っていれば何もしない）"""
+    awake = [m for m in magnets if not m.is_sleeping]
+    if not awake:
+        return
+
+    for m in awake:
+        m.prev_x = m.x
+        m.prev_y = m.y
+
+    if USE_NUMPY_SOLVER:
+        solve_magnetism_np(magnets, MAGNET_MIN_FORCE, h)
+    else:
+        solve_magnetism(magnets, MAGNET_MIN_FORCE, h)
+    for mag in awake:
+        mag.update_physics(h, bounds)
+
+    # 衝突とスリープで同じ候補ペアを使う（グリッドはサブステップに1回だけ作る）
+    pairs = find_candidate_pairs(magnets, margin=WAKE_MARGIN / 2)
+    solve_collisions(magnets, pairs)
+    update_sleep(magnets, pairs)
+
+
+def choose_sub_steps(magnets):
+    """近くにいる磁石ペアの「近づく速さ」からサブステップ数を決める
+
+    前回のtickからの移動量（ドラッグによる移動も含む）で接近速度を測り、
+    1サブステップあたりの接近が MAX_STEP_TRAVEL 以下になるように刻む。
+    吸着直前・接触中（近くて、まだ眠っていない）のペアがあれば基準の SUB_STEPS 以上にする。
+    """
+    if all(m.is_sleeping for m in magnets):
+        return MIN_SUB_STEPS
+
+    fastest = 0.0
+    snapping = False
+    for i, j in find_candidate_pairs(magnets, margin=APPROACH_RANGE / 2):
+        m1 = magnets[i]
+        m2 = magnets[j]
+        if m1.is_sleeping and m2.is_sleeping:
+            continue
+
+        cx = m2.x - m1.x
+        cy = m2.y - m1.y
+        dist = math.hypot(cx, cy)
+        if dist < 1e-6:
+            continue
+
+        # 相対移動量（前回tickから）を中心同士を結ぶ向きに射影
+        rel_x = (m2.x - m2.tick_x) - (m1.x - m1.tick_x)
+        rel_y = (m2.y - m2.tick_y) - (m1.y - m1.tick_y)
+        approach = -(rel_x * cx + rel_y * cy) / dist
+        fastest = max(fastest, approach)
+
+        # 近距離では力が急に強くなる（接触中も力は釣り合っているだけ）ので、
+        # 眠っていない限り細かく刻む
+        if not snapping and _gap(m1, m2) < APPROACH_RANGE:
+            snapping = True
+
+    steps = math.ceil(fastest / MAX_STEP_TRAVEL)
+    if snapping:
+        steps = max(steps, SUB_STEPS)
+    return max(MIN_SUB_STEPS, min(MAX_SUB_STEPS, steps))
+
+
+def physics_tick(magnets, bounds=(WIDTH, HEIGHT)):
+    """固定タイムステップ1回分（FIXED_DT秒）の物理を進め、使ったサブステップ数を返す"""
+    steps = choose_sub_steps(magnets)
+    h = SUB_STEPS / steps
+    for _ in range(steps):
+        step_physics(magnets, h, bounds)
+
+    for mag in magnets:
+        mag.tick_x = mag.x
+        mag.tick_y = mag.y
+    return steps
+
+
+class MagnetSimulation:
+    """画面を開かずに磁石の物理だけを進める（ベンチマーク・テスト用）
+
+    pygame.display を使わないので、pygame.init() 無しでも動く。
+    """
+
+    def __init__(self, width=WIDTH, height=HEIGHT):
+        self.width = width
+        self.height = height
+        self.magnets = []
+
+        # 統計
+        self.ticks = 0
+        self.sub_steps = 0
+
+    def add_magnet(self, x, y, turns=0):
+        """磁石を置く（turns は90度回転の回数）"""
+        mag = BarMagnet(x, y)
+        for _ in range(turns % 4):
+            mag.rotate(1)
+        self.magnets.append(mag)
+        return mag
+
+    def step(self):
+        """物理を1tick（FIXED_DT秒）進めて、使ったサブステップ数を返す"""
+        steps = physics_tick(self.magnets, (self.width, self.height))
+        self.ticks += 1
+        self.sub_steps += steps
+        return steps
+
+    def run(self, ticks):
+        """ticks 回 step() して、合計サブステップ数を返す"""
+        total = 0
+        for _ in range(ticks):
+            total += self.step()
+        return total
+
+    def state(self):
+        """全磁石の状態 (x, y, vx, vy, angle, is_sleeping) のリスト"""
+        return [(m.x, m.y, m.vx, m.vy, m.angle, m.is_sleeping) for m in self.magnets]
 
 
 def main():
@@ -281,22 +798,27 @@ def main():
     pygame.display.set_caption("Magnetic Snap: R/L to Rotate")
     clock = pygame.time.Clock()
     font = pygame.font.SysFont("Arial", 18, bold=True)
+    inputs = input_trace.open_input()
 
-    magnets = []
+    sim = MagnetSimulation()
     # 初期配置
-    magnets.append(BarMagnet(300, 200))
-    magnets.append(BarMagnet(500, 200))
-    magnets.append(BarMagnet(300, 400))
-    magnets.append(BarMagnet(500, 400))
+    sim.add_magnet(300, 200)
+    sim.add_magnet(500, 200)
+    sim.add_magnet(300, 400)
+    sim.add_magnet(500, 400)
+    magnets = sim.magnets
 
     dragging_magnet = None
     offset_x, offset_y = 0, 0
 
+    # 描画と物理を切り離すためのアキュムレータ
+    accumulator = 0.0
+
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
+        mouse_pos = inputs.get_pos()
 
-        for event in pygame.event.get():
+        for event in inputs.get_events():
             if event.type == pygame.QUIT:
                 running = False
 
@@ -308,6 +830,7 @@ def main():
                             dragging_magnet = mag
                             mag.is_dragging = True
                             mag.drag_mode = btn
+                            mag.wake()
 
                             mag.vx = 0
                             mag.vy = 0
@@ -322,6 +845,7 @@ def main():
                 if dragging_magnet:
                     dragging_magnet.is_dragging = False
                     dragging_magnet.drag_mode = 0
+                    dragging_magnet.wake()
                     dragging_magnet = None
 
             # --- 回転操作 (R/L) ---
@@ -346,13 +870,14 @@ def main():
             dragging_magnet.x = mouse_pos[0] + offset_x
             dragging_magnet.y = mouse_pos[1] + offset_y
 
-        # 物理サブステップ
-        dt = 1.0 / SUB_STEPS
-        for _ in range(SUB_STEPS):
-            solve_magnetism(magnets)
-            for mag in magnets:
-                mag.update_physics()
-            solve_collisions(magnets)
+        # 物理：経過時間を固定タイムステップで消化する
+        ticks = 0
+        while accumulator >= FIXED_DT and ticks < MAX_TICKS_PER_FRAME:
+            sim.step()
+            accumulator -= FIXED_DT
+            ticks += 1
+        if accumulator >= FIXED_DT:
+            accumulator = 0.0  # 追いつけなかった分は捨てる（スローモーションになる）
 
         # 描画
         screen.fill(BG_COLOR)
@@ -369,15 +894,15 @@ def main():
             mag.draw(screen, font)
 
         # 説明
-        txt = font.render(
+        txt = render_text(
+            font,
             "Drag: Move | R/L Key: Rotate 90deg | Right Click: Detach",
-            True,
             (150, 150, 150),
         )
         screen.blit(txt, (20, HEIGHT - 30))
 
         pygame.display.flip()
-        clock.tick(60)
+        accumulator += inputs.tick(clock, RENDER_FPS) / 1000.0
 
     pygame.quit()
 
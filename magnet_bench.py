@@ -0,0 +1,198 @@
+"""magnet.py の物理ベンチマーク（画面は開かない）
+
+使い方:
+    python magnet_bench.py                      # 全シナリオを実行してJSONを表示
+    python magnet_bench.py --output result.json # 結果をファイルに保存
+    python magnet_bench.py --baseline result.json --tolerance 0.2
+        # 前回の結果より20%以上遅くなったシナリオがあれば終了コード1
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import magnet
+
+# --- ベンチマーク設定 ---
+COUNTS = [4, 64, 512, 2048]  # 磁石の数
+LAYOUTS = ["random", "clustered"]  # 配置パターン
+COVERAGE = 0.2  # 盤面のうち磁石が占める割合（盤面の広さを数に合わせて決める）
+CLUSTER_SIZE = 16  # クラスタ配置での1かたまりの磁石数
+SEED = 1234
+
+# 大きいシナリオほど1tickが重いので、計測するtick数を減らす
+TICKS = {4: 300, 64: 60, 512: 10, 2048: 2}
+WARMUP_TICKS = 1
+ALLOC_TICKS = 1  # tracemalloc は遅いので、割り当ての計測は少しだけ
+MIN_REGRESSION_MS = 0.05  # これ未満の差は誤差として無視する（ms/サブステップ）
+
+
+def build_scenario(count, layout, seed=SEED):
+    """count 個の磁石を layout で並べた MagnetSimulation を作る"""
+    rng = random.Random(seed)
+
+    magnet_area = 140 * 40
+    side = math.sqrt(count * magnet_area / COVERAGE)
+    width = max(magnet.WIDTH, int(side * 4 / 3))
+    height = max(magnet.HEIGHT, int(side * 3 / 4))
+
+    sim = magnet.MagnetSimulation(width, height)
+
+    if layout == "random":
+        for _ in range(count):
+            sim.add_magnet(
+                rng.uniform(70, width - 70),
+                rng.uniform(70, height - 70),
+                rng.randrange(4),
+            )
+    elif layout == "clustered":
+        # かたまりの中心をばらまいて、その周りに磁石を集める
+        n_clusters = max(1, count // CLUSTER_SIZE)
+        centers = [
+            (rng.uniform(200, width - 200), rng.uniform(200, height - 200))
+            for _ in range(n_clusters)
+        ]
+        for i in range(count):
+            cx, cy = centers[i % n_clusters]
+            x = min(width - 70, max(70, rng.gauss(cx, 100)))
+            y = min(height - 70, max(70, rng.gauss(cy, 100)))
+            sim.add_magnet(x, y, rng.randrange(4))
+    else:
+        raise ValueError(f"unknown layout: {layout}")
+
+    return sim
+
+
+def measure_allocations(sim, ticks):
+    """ticks 回 step() して、1tick の途中で一時的に増えたメモリの最大値
+    (peak_bytes_per_tick) を tracemalloc で測る
+
+    スナップショットの差は生きている割り当てしか見えず、途中で作って捨てた
+    配列は数えられないので、割り当ての回数ではなくこの最大値で見る。
+    1回目は NumPy 内部のキャッシュなどを確保するので、
+    トレースを始めてから1tick進めた後で計測を始める。
+    """
+    tracemalloc.start()
+    sim.step()
+    peak = 0
+    for _ in range(ticks):
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        sim.step()
+        _, top = tracemalloc.get_traced_memory()
+        peak = max(peak, top - start)
+    tracemalloc.stop()
+    return {"peak_bytes_per_tick": peak}
+
+
+def run_scenario(count, layout, ticks=None, seed=SEED):
+    """1シナリオを計測して結果のdictを返す"""
+    if ticks is None:
+        ticks = TICKS.get(count, 10)
+
+    sim = build_scenario(count, layout, seed)
+    sim.run(WARMUP_TICKS)
+
+    start_steps = sim.sub_steps
+    start = time.perf_counter()
+    sim.run(ticks)
+    elapsed = time.perf_counter() - start
+    sub_steps = sim.sub_steps - start_steps
+
+    result = {
+        "name": f"{layout}-{count}",
+        "magnets": count,
+        "layout": layout,
+        "board": [sim.width, sim.height],
+        "ticks": ticks,
+        "sub_steps": sub_steps,
+        "seconds": elapsed,
+        "ticks_per_second": ticks / elapsed,
+        "steps_per_second": sub_steps / elapsed,
+        "ms_per_sub_step": elapsed / sub_steps * 1000.0 if sub_steps else 0.0,
+        "sleeping": sum(m.is_sleeping for m in sim.magnets),
+    }
+    result.update(measure_allocations(sim, ALLOC_TICKS))
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """baseline より tolerance 以上遅くなったシナリオの名前を返す"""
+    old = {r["name"]: r for r in baseline["results"]}
+    slower = []
+    for r in results:
+        prev = old.get(r["name"])
+        if prev is None:
+            continue
+        limit = max(
+            prev["ms_per_sub_step"] * (1.0 + tolerance),
+            prev["ms_per_sub_step"] + MIN_REGRESSION_MS,
+        )
+        if r["ms_per_sub_step"] > limit:
+            slower.append(r["name"])
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="magnet.py physics benchmark")
+    parser.add_argument("--counts", type=int, nargs="+", default=COUNTS)
+    parser.add_argument("--layouts", nargs="+", default=LAYOUTS, choices=LAYOUTS)
+    parser.add_argument("--ticks", type=int, default=None, help="計測するtick数")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument(
+        "--min-force",
+        type=float,
+        default=magnet.MAGNET_MIN_FORCE,
+        help="solve_magnetism のカットオフ（magnet.MAGNET_MIN_FORCE を上書き）",
+    )
+    parser.add_argument("--output", help="結果のJSONを保存するパス")
+    parser.add_argument("--baseline", help="比較する過去の結果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    magnet.MAGNET_MIN_FORCE = args.min_force
+
+    results = []
+    for count in args.counts:
+        for layout in args.layouts:
+            r = run_scenario(count, layout, args.ticks, args.seed)
+            results.append(r)
+            print(
+                f"{r['name']:>16}: {r['steps_per_second']:10.1f} steps/s "
+                f"{r['ms_per_sub_step']:8.3f} ms/step "
+                f"{r['peak_bytes_per_tick'] / 1024:8.1f} KB peak/tick",
+                file=sys.stderr,
+            )
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "numpy_solver": magnet.USE_NUMPY_SOLVER,
+        "min_force": magnet.MAGNET_MIN_FORCE,
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = compare(results, baseline, args.tolerance)
+        if slower:
+            print(f"Regression: {', '.join(slower)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
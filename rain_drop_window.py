@@ -1,67 +1,599 @@
 import pygame
 import random
 import math
+import os
+import hashlib
+import numpy as np
+
+import input_trace
 
 # --- 設定パラメータ ---
 WIDTH, HEIGHT = 800, 600
 BG_COLOR = (20, 25, 35)  # 背景（夜の街）
+BG_LIGHT_COUNT = 60  # ボケた街の光の数
+BG_LIGHT_COLORS = [(30, 50, 70), (70, 40, 30), (40, 40, 50)]
+BG_LIGHT_RADIUS = (20, 80)  # 光の半径の範囲
+BG_RING_STEP = 5  # 光1つは半径をこれずつ縮めた円を重ねたもの
+BG_RING_ALPHA = 3  # 円1枚のアルファ
+BG_SEED = 2024  # 夜景の乱数シード（None にすると毎回違う夜景、キャッシュしない）
+BG_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "digital_dailylife")
+BG_CACHE_VERSION = 2  # 描き方（コード）を変えたら上げる（設定値はキーに入っている）
 
 # --- 水滴の設定（外側） ---
 STATIC_DROP_COUNT = 2000  # びっしり張り付く数
 STATIC_DROP_COLOR = (180, 200, 220)
 FALLING_DROP_COLOR = (220, 230, 255)
 SPAWN_SPEED = 30  # 雨がガラスに付着する速度
+DROP_CELL_SIZE = 32  # 静止水滴を探すためのグリッドの大きさ(px)
+MAX_FALLING_DROPS = 4096  # 同時に落ちていられる雨粒の上限
+MAX_FALLING_RADIUS = 14  # 巻き込んで太れる上限(px)
+MAX_FALL_SPEED = 14.0  # 太っても出せる速さの上限(px/フレーム)
+ABSORB_RATIO = 0.2  # 巻き込んだ静止水滴の面積のうち、雨粒が太る割合
+FALL_SPEEDUP = 0.5  # 面積が k 倍になると速さは k^FALL_SPEEDUP 倍
 
 # --- 結露の設定（内側） ---
 FOG_COLOR = (255, 255, 255)  # 白
 FOG_MAX_ALPHA = 50  # ★初期状態のうっすら加減（最大値）
 FOG_REGEN_SPEED = 0.05  # 戻る速度 (0.05 = 20フレームに1回)
 WIPE_RADIUS = 15  # 指の太さ
+FOG_TILE = 32  # 霧の再生を管理するタイルの大きさ(px)
+
+
+def _ragged_arange(starts, counts):
+    """starts[i] から counts[i] 個ずつの連番をつなげた配列と、その持ち主 i"""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+
+class FallingDropField:
+    """上から流れてきて、外側の水滴を巻き込みながら太る雨粒（配列でまとめて管理）
+
+    x, y, r, vy を NumPy配列で持ち、生きている雨粒は常に先頭 [0:count] に詰める。
+    1フレームの処理は
+      1. 移動（前の位置から今の位置までの軌跡で静止水滴を巻き込む）
+      2. 巻き込んだ分だけ太り、重くなった分だけ速くなる
+      3. 触れ合った雨粒どうしを合体させる
+      4. 画面の下に抜けたものを詰めて消す
+    で、どれも配列演算なので数千個あっても Python のループにはならない。
+    """
+
+    def __init__(self, capacity=MAX_FALLING_DROPS):
+        self.capacity = capacity
+        self.count = 0
+
+        self.x = np.zeros(capacity, dtype=np.float32)
+        self.y = np.zeros(capacity, dtype=np.float32)
+        self.r = np.zeros(capacity, dtype=np.float32)
+        self.vy = np.zeros(capacity, dtype=np.float32)
+
+        self._arrays = (self.x, self.y, self.r, self.vy)
+
+        # 半径ごとの画像（本体 + ハイライト）
+        self.sprites = {}
+        for r in range(1, MAX_FALLING_RADIUS + 1):
+            s = pygame.Surface((r * 2 + 1, r * 2 + 1), pygame.SRCALPHA)
+            pygame.draw.circle(s, FALLING_DROP_COLOR, (r, r), r)
+            off = int(r * 0.3)
+            pygame.draw.circle(s, (255, 255, 255), (r - off, r - off), int(r * 0.3))
+            self.sprites[r] = s
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, x, vy, r=None):
+        """画面の上に1つ出す（満杯なら出さない）"""
+        if self.count >= self.capacity:
+            return
+        i = self.count
+        self.x[i] = x
+        self.y[i] = -20
+        self.r[i] = random.randint(6, 10) if r is None else r
+        self.vy[i] = vy
+        self.count += 1
+
+    def update(self, static_drops=None):
+        n = self.count
+        if n == 0:
+            return
+
+        x, y, r, vy = self.x[:n], self.y[:n], self.r[:n], self.vy[:n]
+        prev_y = y.copy()
+        y += vy
+
+        # 通り道の静止水滴を巻き込む（速くても取りこぼさない）
+        if static_drops is not None:
+            absorbed = static_drops.absorb_along(x, prev_y, y, r + 5)
+            self._grow(np.arange(n), absorbed * ABSORB_RATIO)
+
+        self._merge()
+        self._cull()
+
+    def _grow(self, idx, area):
+        """idx の雨粒の面積を area だけ増やし、増えた割合に応じて速くする"""
+        grow = area > 0
+        if not grow.any():
+            return
+        idx, area = idx[grow], area[grow]
+
+        old = self.r[idx] ** 2
+        new = old + area
+        self.r[idx] = np.minimum(np.sqrt(new), MAX_FALLING_RADIUS)
+        self.vy[idx] = np.minimum(
+            self.vy[idx] * (new / old) ** FALL_SPEEDUP, MAX_FALL_SPEED
+        )
 
+    def _merge(self):
+        """触れ合った雨粒を、大きい方に小さい方を吸収させて1つにする"""
+        n = self.count
+        if n < 2:
+            return
+
+        x, y, r = self.x[:n], self.y[:n], self.r[:n]
+        cell = MAX_FALLING_RADIUS * 2
+        cx = (x // cell).astype(np.int64)
+        cy = (y // cell).astype(np.int64)
+        cols = int(cx.max()) + 2
+        keys = (cy - int(cy.min()) + 1) * cols + cx + 1
+
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        # 自分のセルと、右・左下・下・右下のセルにいる相手だけを調べる
+        pairs_i, pairs_j = [], []
+        for dx, dy in ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+            target = keys + dy * cols + dx
+            lo = np.searchsorted(sorted_keys, target, "left")
+            hi = np.searchsorted(sorted_keys, target, "right")
+            i, pos = _ragged_arange(lo, hi - lo)
+            j = order[pos]
+            if dx == 0 and dy == 0:
+                keep = i < j
+                i, j = i[keep], j[keep]
+            pairs_i.append(i)
+            pairs_j.append(j)
+        i = np.concatenate(pairs_i)
+        j = np.concatenate(pairs_j)
+
+        ddx = x[i] - x[j]
+        ddy = y[i] - y[j]
+        rr = r[i] + r[j]
+        touch = ddx * ddx + ddy * ddy < rr * rr
+        if not touch.any():
+            return
+        i, j = i[touch], j[touch]
+
+        # 小さい方（同じなら番号の大きい方）が吸収される
+        i_wins = (r[i] > r[j]) | ((r[i] == r[j]) & (i < j))
+        winner = np.where(i_wins, i, j)
+        loser = np.where(i_wins, j, i)
+
+        # 吸収される雨粒は1回だけ。吸収された側が同じフレームで別の雨粒を
+        # 吸収することはしない（連鎖は次のフレームで解ける）
+        loser, first = np.unique(loser, return_index=True)
+        winner = winner[first]
+        ok = ~np.isin(winner, loser)
+        winner, loser = winner[ok], loser[ok]
+        if len(loser) == 0:
+            return
+
+        # 位置は面積で重み付けした平均、速さは吸収した重さの分だけ上がる
+        area = r[loser] ** 2
+        w_area = np.zeros(n, dtype=np.float32)
+        w_x = np.zeros(n, dtype=np.float32)
+        w_y = np.zeros(n, dtype=np.float32)
+        np.add.at(w_area, winner, area)
+        np.add.at(w_x, winner, area * x[loser])
+        np.add.at(w_y, winner, area * y[loser])
+
+        won = np.unique(winner)
+        own = r[won] ** 2
+        mass = own + w_area[won]
+        x[won] = (own * x[won] + w_x[won]) / mass
+        y[won] = (own * y[won] + w_y[won]) / mass
+        self._grow(won, w_area[won])
+
+        # 吸収された雨粒は画面外に飛ばして _cull で消す
+        y[loser] = np.inf
+
+    def _cull(self):
+        """画面の下に抜けた雨粒を詰めて消す"""
+        n = self.count
+        alive = self.y[:n] <= HEIGHT + 50
+        k = int(np.count_nonzero(alive))
+        if k < n:
+            for arr in self._arrays:
+                arr[:k] = arr[:n][alive]
+            self.count = k
 
-class FallingDrop:
-    """上から流れてきて、外側の水滴だけを巻き込む雨粒"""
+    def draw(self, screen):
+        n = self.count
+        if n == 0:
+            return
+
+        rs = self.r[:n].astype(np.int32)
+        xs = (self.x[:n].astype(np.int32) - rs).tolist()
+        ys = (self.y[:n].astype(np.int32) - rs).tolist()
+
+        sprites = self.sprites
+        screen.blits(
+            [(sprites[r], (x, y)) for r, x, y in zip(rs.tolist(), xs, ys)],
+            doreturn=False,
+        )
 
-    def __init__(self, x, vy):
-        self.x = x
-        self.y = -20
-        self.r = random.randint(6, 10)
-        self.vy = vy
-        self.to_remove = False
 
-    def update(self):
-        self.y += self.vy
-        if self.y > HEIGHT + 50:
-            self.to_remove = True
+class StaticDropField:
+    """ガラスに張り付いた静止水滴（配列 + バケットグリッド）
+
+    水滴は x, y, r の配列（SoA）に入れ、空き番号は free に積んでおく。
+    さらに生きている水滴の番号を DROP_CELL_SIZE 四方のセル番号順に並べた配列
+    （keys / order）を持つので、落ちてくる雨粒は自分の半径が触れるセルの範囲を
+    searchsorted で引くだけでよい。この並びは付着・削除の時に差分だけ更新する。
+
+    見た目は「外側のガラス」レイヤー（layer）に描き溜めておく。
+    付着した時に1個ずつスタンプし、消えた時はその周りだけ透明に戻して
+    残った水滴を描き直すので、毎フレームは layer を1回blitするだけで済む。
+    """
+
+    def __init__(self, capacity, width=WIDTH, height=HEIGHT, cell=DROP_CELL_SIZE):
+        self.capacity = capacity
+        self.width = width
+        self.height = height
+        self.cell = cell
+
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.r = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))  # 空き番号（末尾から使う）
+
+        # 座標は 0 ~ width/height（両端を含む）なので +1
+        self.cols = width // cell + 1
+        self.rows = height // cell + 1
+        self.keys = np.zeros(0, dtype=np.int32)  # セル番号（昇順）
+        self.order = np.zeros(0, dtype=np.intp)  # keys と同じ並びの水滴番号
+
+        self.layer = pygame.Surface((width + 1, height + 1), pygame.SRCALPHA)
+        self.layer.fill((0, 0, 0, 0))
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def spawn(self, n):
+        """ランダムな位置に n 個付着させる（空きが無い分は無視）"""
+        n = min(n, len(self.free))
+        if n <= 0:
+            return
+
+        idx = np.array([self.free.pop() for _ in range(n)], dtype=np.intp)
+        self.x[idx] = np.random.randint(0, self.width + 1, n)
+        self.y[idx] = np.random.randint(0, self.height + 1, n)
+        self.r[idx] = np.random.randint(1, 4, n)
+        self.alive[idx] = True
+
+        # セル番号順の並びに差し込む（同じセルの中では後から付いたものが後ろ）
+        keys = self.cell_of(idx)
+        sort = np.argsort(keys, kind="stable")
+        keys, idx_sorted = keys[sort], idx[sort]
+        at = np.searchsorted(self.keys, keys, "right")
+        self.keys = np.insert(self.keys, at, keys)
+        self.order = np.insert(self.order, at, idx_sorted)
+
+        # レイヤーにスタンプ
+        self.stamp(idx)
+
+    def cell_of(self, idx):
+        """idx の水滴が入っているセル番号"""
+        return (self.y[idx] // self.cell) * self.cols + self.x[idx] // self.cell
+
+    def remove(self, idx):
+        """idx の水滴を消す（レイヤーはそのまま。描き直しは patch で）"""
+        self.alive[idx] = False
+        self.free.extend(idx.tolist())
+        keep = self.alive[self.order]
+        self.keys = self.keys[keep]
+        self.order = self.order[keep]
+
+    def stamp(self, idx):
+        """idx の水滴をレイヤーに描く"""
+        for x, y, r in zip(
+            self.x[idx].tolist(), self.y[idx].tolist(), self.r[idx].tolist()
+        ):
+            pygame.draw.circle(self.layer, STATIC_DROP_COLOR, (x, y), r)
+
+    def indices_in(self, rect):
+        """rect に重なるセルに入っている水滴の番号"""
+        cx0 = max(0, rect.left // self.cell)
+        cx1 = min(self.cols - 1, (rect.right - 1) // self.cell)
+        cy0 = max(0, rect.top // self.cell)
+        cy1 = min(self.rows - 1, (rect.bottom - 1) // self.cell)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.zeros(0, dtype=np.intp)
+
+        # 行ごとに、セル番号が連続する範囲 [cx0, cx1] を引く
+        row = np.arange(cy0, cy1 + 1) * self.cols
+        lo = np.searchsorted(self.keys, row + cx0, "left")
+        hi = np.searchsorted(self.keys, row + cx1, "right")
+        _, pos = _ragged_arange(lo, hi - lo)
+        return self.order[pos]
+
+    def patch(self, hit):
+        """消えた水滴 hit の範囲だけ透明に戻し、残った水滴を描き直す"""
+        r = self.r[hit]
+        left = int((self.x[hit] - r).min())
+        top = int((self.y[hit] - r).min())
+        right = int((self.x[hit] + r).max()) + 1
+        bottom = int((self.y[hit] + r).max()) + 1
+        area = pygame.Rect(left, top, right - left, bottom - top)
+
+        self.layer.set_clip(area)
+        self.layer.fill((0, 0, 0, 0), area)
+        # 半径(最大3px)ぶんはみ出してくる隣の水滴も拾う
+        self.stamp(self.indices_in(area.inflate(8, 8)))
+        self.layer.set_clip(None)
+
+    def absorb_along(self, x, y0, y1, radius):
+        """雨粒 k が (x[k], y0[k]) から (x[k], y1[k]) まで動いた軌跡から
+        radius[k] 未満の水滴をまとめて消し、雨粒ごとに巻き込んだ面積(r^2)を返す
+
+        各雨粒が触れるセルの範囲を、セル番号順の並び（keys）から searchsorted で一度に引く。
+        """
+        n = len(x)
+        absorbed = np.zeros(n, dtype=np.float32)
+        if n == 0 or len(self.keys) == 0:
+            return absorbed
+
+        # 雨粒ごとに、軌跡を radius だけ太らせた範囲のセル
+        top = np.minimum(y0, y1)
+        bottom = np.maximum(y0, y1)
+        cx0 = np.maximum(0, np.floor((x - radius) / self.cell)).astype(np.intp)
+        cx1 = np.minimum(self.cols - 1, np.floor((x + radius) / self.cell))
+        cy0 = np.maximum(0, np.floor((top - radius) / self.cell)).astype(np.intp)
+        cy1 = np.minimum(self.rows - 1, np.floor((bottom + radius) / self.cell))
+        cx1 = cx1.astype(np.intp)
+        cy1 = cy1.astype(np.intp)
+        rows = np.where(cx0 <= cx1, np.maximum(cy1 - cy0 + 1, 0), 0)
+
+        # 行ごとに、セル番号が連続する範囲 [cx0, cx1] の水滴を拾う
+        q, cy = _ragged_arange(cy0, rows)
+        lo = np.searchsorted(self.keys, cy * self.cols + cx0[q], "left")
+        hi = np.searchsorted(self.keys, cy * self.cols + cx1[q], "right")
+        owner, pos = _ragged_arange(lo, hi - lo)
+        q = q[owner]
+        idx = self.order[pos]
+
+        # 縦の線分までの距離で判定（止まっていれば円の中かどうかと同じ）
+        sx = self.x[idx]
+        sy = self.y[idx]
+        dx = sx - x[q]
+        dy = sy - np.clip(sy, top[q], bottom[q])
+        rad = radius[q]
+        touch = dx * dx + dy * dy < rad * rad
+        if not touch.any():
+            return absorbed
+        q, idx = q[touch], idx[touch]
+
+        # 2つの雨粒に触れた水滴は先の雨粒だけが巻き込む
+        idx, first = np.unique(idx, return_index=True)
+        q = q[first]
+        absorbed += np.bincount(q, weights=self.r[idx] ** 2, minlength=n).astype(
+            np.float32
+        )
+
+        # 一括で削除
+        self.remove(idx)
+
+        # レイヤーは雨粒ごとに周りだけ描き直す
+        order = np.argsort(q, kind="stable")
+        q, idx = q[order], idx[order]
+        bounds = np.flatnonzero(np.diff(q)) + 1
+        for hit in np.split(idx, bounds):
+            self.patch(hit)
+        return absorbed
 
     def draw(self, screen):
-        # 本体
-        pygame.draw.circle(
-            screen, FALLING_DROP_COLOR, (int(self.x), int(self.y)), int(self.r)
-        )
-        # ハイライト
-        off = int(self.r * 0.3)
-        pygame.draw.circle(
-            screen,
-            (255, 255, 255),
-            (int(self.x - off), int(self.y - off)),
-            int(self.r * 0.3),
-        )
+        screen.blit(self.layer, (0, 0))
+
+
+class FogLayer:
+    """内側の結露（白い霧）
+
+    霧の濃さは surface のアルファそのもので、pygame.surfarray.pixels_alpha で
+    NumPy配列として直接書き換える（RGBは常に白のまま）。
+    再生は FOG_TILE 四方のタイルごとに小数のアキュムレータ（phase）を持ち、
+    1を超えたタイルだけアルファを+1する。拭いたタイルごとに位相がずれるので、
+    20フレームごとに全画面が一斉に濃くなっていた頃より滑らかに戻る。
+    FOG_MAX_ALPHA に戻りきったタイルは計算せず、全部戻ったら何もしない。
+    """
+
+    def __init__(self, width=WIDTH, height=HEIGHT, tile=FOG_TILE):
+        self.width = width
+        self.height = height
+        self.tile = tile
+
+        # RGBは常に白、アルファだけを操作する
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.surface.fill((*FOG_COLOR, FOG_MAX_ALPHA))
+
+        # タイルごとの状態
+        self.tiles_x = math.ceil(width / tile)
+        self.tiles_y = math.ceil(height / tile)
+        self.growing = np.zeros((self.tiles_x, self.tiles_y), dtype=bool)
+        self.phase = np.zeros((self.tiles_x, self.tiles_y), dtype=np.float32)
+
+        # 指ブラシ（円の内側を拭く）。形は pygame.draw.circle と同じにする
+        brush = pygame.Surface((WIPE_RADIUS * 2, WIPE_RADIUS * 2), pygame.SRCALPHA)
+        brush.fill((255, 255, 255, 255))
+        pygame.draw.circle(brush, (0, 0, 0, 0), (WIPE_RADIUS, WIPE_RADIUS), WIPE_RADIUS)
+        self.brush_mask = pygame.surfarray.array_alpha(brush) == 0
+
+    def wipe(self, x, y):
+        """(x, y) を中心に指で拭く"""
+        self.wipe_stroke(x, y, x, y)
+
+    def wipe_stroke(self, x0, y0, x1, y1):
+        """(x0, y0) から (x1, y1) までを指でなぞった跡を拭く
+
+        前フレームと今フレームのマウス位置を結ぶカプセル形（両端は指ブラシ、
+        間は幅 WIPE_RADIUS*2 の帯）のマスクを1枚作り、1回だけ書き込む。
+        素早く動かしても隙間ができず、コストはカプセルの外接矩形の面積だけ。
+        """
+        r = WIPE_RADIUS
+
+        # カプセルの外接矩形（画面内に切る）
+        left = max(0, min(x0, x1) - r)
+        top = max(0, min(y0, y1) - r)
+        right = min(self.width, max(x0, x1) + r)
+        bottom = min(self.height, max(y0, y1) + r)
+        if left >= right or top >= bottom:
+            return
+
+        mask = np.zeros((right - left, bottom - top), dtype=bool)
+
+        # 両端：指ブラシをそのまま押す（止まっていれば1回押したのと同じ）
+        for cx, cy in ((x0, y0), (x1, y1)):
+            bx0, by0 = max(0, left - (cx - r)), max(0, top - (cy - r))
+            bx1 = min(2 * r, right - (cx - r))
+            by1 = min(2 * r, bottom - (cy - r))
+            if bx0 < bx1 and by0 < by1:
+                mx, my = cx - r + bx0 - left, cy - r + by0 - top
+                mask[mx : mx + bx1 - bx0, my : my + by1 - by0] |= self.brush_mask[
+                    bx0:bx1, by0:by1
+                ]
+
+        # 間の帯：線分への射影が両端の間にあり、線分からの距離が r 未満
+        dx, dy = x1 - x0, y1 - y0
+        length2 = dx * dx + dy * dy
+        if length2 > 0:
+            px = np.arange(left, right, dtype=np.float32)[:, None] - x0
+            py = np.arange(top, bottom, dtype=np.float32)[None, :] - y0
+            along = px * dx + py * dy
+            across = px * dy - py * dx
+            mask |= (along > 0) & (along < length2) & (across**2 < r * r * length2)
+
+        alpha = pygame.surfarray.pixels_alpha(self.surface)
+        alpha[left:right, top:bottom][mask] = 0
+        del alpha  # ロック解除
+
+        self.growing[
+            left // self.tile : (right - 1) // self.tile + 1,
+            top // self.tile : (bottom - 1) // self.tile + 1,
+        ] = True
+
+    def regenerate(self, amount=FOG_REGEN_SPEED):
+        """再生中のタイルのアキュムレータを進め、1を超えた分だけ濃くする"""
+        if not self.growing.any():
+            return  # 全部戻っている
+
+        self.phase[self.growing] += amount
+        steps = np.floor(self.phase).astype(np.int32)
+        steps[~self.growing] = 0
+        ready = np.argwhere(steps > 0)
+        if len(ready) == 0:
+            return
+        self.phase -= steps
+
+        t = self.tile
+        alpha = pygame.surfarray.pixels_alpha(self.surface)
+        for tx, ty in ready.tolist():
+            region = alpha[tx * t : (tx + 1) * t, ty * t : (ty + 1) * t]
+            # FOG_MAX_ALPHA + steps は 255 を超えないので uint8 のまま足せる
+            region += np.uint8(steps[tx, ty])
+            np.minimum(region, FOG_MAX_ALPHA, out=region)
+
+            # 戻りきったタイルは次から計算しない
+            if region.min() >= FOG_MAX_ALPHA:
+                self.growing[tx, ty] = False
+                self.phase[tx, ty] = 0.0
+        del alpha  # ロック解除
+
+    def draw(self, screen):
+        screen.blit(self.surface, (0, 0))
+
+
+def _background_key(seed, size, palette):
+    """キャッシュファイル名に使うキー（描いた結果を変える設定は全部入れる）"""
+    params = (
+        BG_CACHE_VERSION,
+        seed,
+        tuple(size),
+        BG_COLOR,
+        tuple(map(tuple, palette)),
+        BG_LIGHT_COUNT,
+        BG_LIGHT_RADIUS,
+        BG_RING_STEP,
+        BG_RING_ALPHA,
+    )
+    return hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+
+
+_ring_sprites = {}  # (半径, 色, アルファ) -> 円
+
+
+def ring_sprite(radius, color):
+    """光を作る円1枚（アルファ3）。同じ半径・色の円は使い回す"""
+    key = (radius, tuple(color), BG_RING_ALPHA)
+    sprite = _ring_sprites.get(key)
+    if sprite is None:
+        sprite = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+        pygame.draw.circle(sprite, (*color, BG_RING_ALPHA), (radius, radius), radius)
+        _ring_sprites[key] = sprite
+    return sprite
+
 
+def render_background(seed, size=(WIDTH, HEIGHT), palette=BG_LIGHT_COLORS):
+    """ボケた夜景を描く（同じ seed なら同じ夜景）
 
-def create_background():
-    """ボケた夜景"""
-    bg = pygame.Surface((WIDTH, HEIGHT))
+    光1つは半径を5pxずつ縮めたアルファ3の円を重ねたもの。
+    アルファ3の整数ブレンドは下の色との差が小さいと丸めで止まるので、
+    1枚のアルファにまとめると色が変わってしまう。円は1枚ずつ blit する。
+    """
+    rng = random.Random(seed)
+    width, height = size
+    bg = pygame.Surface(size)
     bg.fill(BG_COLOR)
-    for _ in range(60):
-        x = random.randint(0, WIDTH)
-        y = random.randint(0, HEIGHT)
-        radius = random.randint(20, 80)
-        color = random.choice([(30, 50, 70), (70, 40, 30), (40, 40, 50)])
-        for r in range(radius, 0, -5):
-            s = pygame.Surface((r * 2, r * 2), pygame.SRCALPHA)
-            pygame.draw.circle(s, (*color, 3), (r, r), r)
-            bg.blit(s, (x - r, y - r))
+
+    for _ in range(BG_LIGHT_COUNT):
+        x = rng.randint(0, width)
+        y = rng.randint(0, height)
+        radius = rng.randint(*BG_LIGHT_RADIUS)
+        color = rng.choice(palette)
+        for r in range(radius, 0, -BG_RING_STEP):
+            bg.blit(ring_sprite(r, color), (x - r, y - r))
+    return bg
+
+
+def create_background(seed=BG_SEED, size=(WIDTH, HEIGHT), palette=BG_LIGHT_COLORS):
+    """ボケた夜景（同じ seed・大きさ・色ならディスクのキャッシュを使う）
+
+    キャッシュは RGB の生バイト列。PNG より読み込みが速い。
+    """
+    if seed is None:
+        return render_background(random.randrange(2**32), size, palette)
+
+    size = tuple(size)
+    path = os.path.join(
+        BG_CACHE_DIR, f"bokeh-{_background_key(seed, size, palette)}.rgb"
+    )
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) == size[0] * size[1] * 3:
+            return pygame.image.frombytes(data, size, "RGB")
+    except OSError:
+        pass
+
+    bg = render_background(seed, size, palette)
+
+    # キャッシュに書けなくても動作には関係ないので、失敗は無視する
+    try:
+        os.makedirs(BG_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(pygame.image.tobytes(bg, "RGB"))
+        os.replace(tmp, path)
+    except OSError:
+        pass
     return bg
 
 
@@ -70,114 +602,54 @@ def main():
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption("Rainy Window: White Fog Regeneration")
     clock = pygame.time.Clock()
+    inputs = input_trace.open_input()
 
     background = create_background()
 
     # --- 外側の世界：静止水滴 ---
-    static_drops = []
-    for _ in range(STATIC_DROP_COUNT):
-        static_drops.append(
-            [random.randint(0, WIDTH), random.randint(0, HEIGHT), random.randint(1, 3)]
-        )
+    static_drops = StaticDropField(STATIC_DROP_COUNT)
+    static_drops.spawn(STATIC_DROP_COUNT)
 
     # 外側の世界：落ちてくる雨粒
-    falling_drops = []
+    falling_drops = FallingDropField()
 
-    # --- 内側の世界：結露レイヤーシステム ---
-
-    # 1. 現在の霧レイヤー
+    # --- 内側の世界：結露レイヤー ---
     # 初期状態： (255, 255, 255, 50) = うっすら白い
-    fog_surface = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-    fog_surface.fill((*FOG_COLOR, FOG_MAX_ALPHA))
-
-    # 2. ★修正ポイント：回復用レイヤー
-    # 以前は (0, 0, 0, 1) を足していたため、拭いた跡（0,0,0,0）が黒く濁っていきました。
-    # 今回は (255, 255, 255, 1) を足します。
-    # これにより、透明な部分が一瞬で「白い色」を取り戻しつつ、Alphaだけが1ずつ増えます。
-    fog_adder = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-    fog_adder.fill((255, 255, 255, 1))
-
-    # 3. 上限キャップ用レイヤー
-    # これ以上濃くならない（白くなりすぎない）ための蓋
-    fog_limit = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-    fog_limit.fill((*FOG_COLOR, FOG_MAX_ALPHA))
-
-    # 4. 指ブラシ（透明にする）
-    wiper_brush = pygame.Surface((WIPE_RADIUS * 2, WIPE_RADIUS * 2), pygame.SRCALPHA)
-    # ブラシの外側は白（保存）
-    wiper_brush.fill((255, 255, 255, 255))
-    # ブラシの内側は透明（削除: 0,0,0,0）
-    pygame.draw.circle(
-        wiper_brush, (0, 0, 0, 0), (WIPE_RADIUS, WIPE_RADIUS), WIPE_RADIUS
-    )
-
-    regen_counter = 0.0
+    fog = FogLayer()
+    last_wipe = None  # 直前に拭いた位置（ボタンを離すとリセット）
 
     running = True
     while running:
-        for event in pygame.event.get():
+        for event in inputs.get_events():
             if event.type == pygame.QUIT:
                 running = False
 
         # --- 1. 内側の処理（指で曇りを拭く） ---
-        if pygame.mouse.get_pressed()[0]:
-            mx, my = pygame.mouse.get_pos()
-            # 結露レイヤーだけを透明にする (Alpha=0, RGB=0 になる)
-            fog_surface.blit(
-                wiper_brush,
-                (mx - WIPE_RADIUS, my - WIPE_RADIUS),
-                special_flags=pygame.BLEND_RGBA_MIN,
-            )
+        # 前フレームの位置から線でつなぐので、素早く動かしても途切れない
+        if inputs.get_pressed()[0]:
+            mx, my = inputs.get_pos()
+            if last_wipe is None:
+                last_wipe = (mx, my)
+            fog.wipe_stroke(*last_wipe, mx, my)
+            last_wipe = (mx, my)
+        else:
+            last_wipe = None
 
         # --- 2. 曇りの超スロー再生（白く戻す） ---
-        regen_counter += FOG_REGEN_SPEED
-        if regen_counter >= 1.0:
-            # A. 全体に「白 + Alpha1」を足す
-            # 拭いた跡 (0,0,0,0) + (255,255,255,1) = (255,255,255,1) -> うっすら白い霧が出現
-            fog_surface.blit(fog_adder, (0, 0), special_flags=pygame.BLEND_RGBA_ADD)
-
-            # B. 上限カット（初期状態より濃くしない）
-            fog_surface.blit(fog_limit, (0, 0), special_flags=pygame.BLEND_RGBA_MIN)
-
-            regen_counter = 0.0
+        fog.regenerate()
 
         # --- 3. 外側の処理（雨粒） ---
 
         # 静止水滴の付着
         if len(static_drops) < STATIC_DROP_COUNT:
-            for _ in range(SPAWN_SPEED):
-                static_drops.append(
-                    [
-                        random.randint(0, WIDTH),
-                        random.randint(0, HEIGHT),
-                        random.randint(1, 3),
-                    ]
-                )
+            static_drops.spawn(SPAWN_SPEED)
 
         # 落ちてくる雨粒
         if random.randint(0, 100) < 4:
-            falling_drops.append(
-                FallingDrop(random.randint(0, WIDTH), random.uniform(4, 7))
-            )
-
-        # 雨粒の更新と巻き込み
-        for f_drop in falling_drops:
-            f_drop.update()
-
-            limit_dist_sq = (f_drop.r + 5) ** 2
-
-            # 外側の静止水滴だけを消す
-            static_drops = [
-                s
-                for s in static_drops
-                if not (
-                    abs(s[0] - f_drop.x) < f_drop.r + 5
-                    and abs(s[1] - f_drop.y) < f_drop.r + 5
-                    and (s[0] - f_drop.x) ** 2 + (s[1] - f_drop.y) ** 2 < limit_dist_sq
-                )
-            ]
+            falling_drops.spawn(random.randint(0, WIDTH), random.uniform(4, 7))
 
-        falling_drops = [f for f in falling_drops if not f.to_remove]
+        # 雨粒の更新と巻き込み（外側の静止水滴だけを消す）
+        falling_drops.update(static_drops)
 
         # --- 描画 ---
 
@@ -185,18 +657,16 @@ def main():
         screen.blit(background, (0, 0))
 
         # Layer 2: 外側の静止水滴
-        for s in static_drops:
-            pygame.draw.circle(screen, STATIC_DROP_COLOR, (s[0], s[1]), s[2])
+        static_drops.draw(screen)
 
         # Layer 3: 外側の落ちてくる雨粒
-        for f in falling_drops:
-            f.draw(screen)
+        falling_drops.draw(screen)
 
         # Layer 4: 内側の結露（一番手前）
-        screen.blit(fog_surface, (0, 0))
+        fog.draw(screen)
 
         pygame.display.flip()
-        clock.tick(60)
+        inputs.tick(clock, 60)
 
     pygame.quit()
 
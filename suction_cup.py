@@ -3,6 +3,8 @@ import math
 import random
 import os
 
+import input_trace
+
 # --- 設定パラメータ ---
 WIDTH, HEIGHT = 800, 600
 BG_COLOR = (240, 245, 255)
@@ -188,6 +190,7 @@ def main():
     pygame.display.set_caption("Suction Cup: Toggle Stick & Safety Release")
     clock = pygame.time.Clock()
     font = pygame.font.SysFont("Arial", 20)
+    inputs = input_trace.open_input()
 
     # 音源読み込み
     has_sound = False
@@ -212,10 +215,10 @@ def main():
 
     running = True
     while running:
-        mouse_pos = pygame.mouse.get_pos()
-        mouse_pressed = pygame.mouse.get_pressed()[0]
+        mouse_pos = inputs.get_pos()
+        mouse_pressed = inputs.get_pressed()[0]
 
-        for event in pygame.event.get():
+        for event in inputs.get_events():
             if event.type == pygame.QUIT:
                 running = False
 
@@ -289,7 +292,7 @@ def main():
         screen.blit(txt, (20, HEIGHT - 30))
 
         pygame.display.flip()
-        clock.tick(60)
+        inputs.tick(clock, 60)
 
     if has_sound:
         sound_kyu.stop()